@@ -0,0 +1,172 @@
+"""Sorted album index of mpd queue with prefix trie.
+
+album is a run of queue songs with same Album tag as next_album sees it,
+so an album queued twice has two entries. Index is built by playlistinfo
+once and updated by plchanges when playlist version is changed.
+"""
+
+import bisect
+
+
+# trie keeps prefix counts up to this length, longer prefix is bisected
+TRIE_DEPTH = 3
+OTHER = '#'
+# rebuild sorted entries instead of removing one by one
+REBUILD_RATIO = 0.25
+
+
+def sort_key(name):
+    """Return upper case sort key, non alphanumeric head goes to OTHER."""
+    key = ' '.join(name.upper().split())
+    if not key or not key[0].isalnum() or ord(key[0]) >= 0x80:
+        key = OTHER + key
+    return key
+
+
+class Trie(object):
+
+    """Prefix counts of keys."""
+
+    def __init__(self, depth=TRIE_DEPTH):
+        """Create empty root node, node is [count, children]."""
+        self.depth = depth
+        self._root = [0, {}]
+
+    def add(self, key, count=1):
+        """Add key count, negative count removes."""
+        node = self._root
+        node[0] += count
+        for char in key[:self.depth]:
+            parent = node
+            node = parent[1].setdefault(char, [0, {}])
+            node[0] += count
+            if not node[0]:
+                del parent[1][char]
+                return
+
+    def _node(self, prefix):
+        """Return node of prefix or None."""
+        node = self._root
+        for char in prefix:
+            node = node[1].get(char)
+            if node is None:
+                return None
+        return node
+
+    def count(self, prefix=''):
+        """Return key count which starts with prefix."""
+        node = self._node(prefix[:self.depth])
+        return node[0] if node else 0
+
+    def children(self, prefix=''):
+        """Return sorted next chars of prefix."""
+        node = self._node(prefix)
+        return sorted(node[1]) if node else []
+
+
+class AlbumIndex(object):
+
+    """Albums sorted by name with first queue position."""
+
+    def __init__(self, transliterate=None):
+        """Create empty index, transliterate converts name to ascii."""
+        self.transliterate = transliterate
+        self.version = None
+        self.trie = Trie()
+        # album name of each queue position
+        self._albums = []
+        # first queue positions of albums in queue order
+        self._starts = []
+        # sort key of each first position
+        self._keys = {}
+        # (sort key, first position, album name) sorted by key
+        self._entries = []
+
+    def __len__(self):
+        """Return album count."""
+        return len(self._entries)
+
+    def __getitem__(self, index):
+        """Return (sort key, first position, album name)."""
+        return self._entries[index]
+
+    def update(self, client):
+        """Fetch queue changes and return True if index is changed."""
+        status = client.status()
+        version = int(status['playlist'])
+        length = int(status.get('playlistlength', 0))
+        if version == self.version:
+            return False
+        if self.version is None or version < self.version:
+            # first build or mpd is restarted
+            songs = client.songs('playlistinfo')
+            first = 0
+        else:
+            songs = client.songs('plchanges', self.version)
+            first = min(length, len(self._albums))
+        albums = self._albums[:length]
+        albums.extend([None] * (length - len(albums)))
+        for song in songs:
+            pos = int(song['Pos'])
+            if pos < length:
+                albums[pos] = song.get('Album', '').strip()
+                first = min(first, pos)
+        self._albums = albums
+        self.version = version
+        self._update_from(first)
+        return True
+
+    def _update_from(self, first):
+        """Replace albums starting at or after queue position first."""
+        cut = bisect.bisect_left(self._starts, first)
+        removed = self._starts[cut:]
+        del self._starts[cut:]
+        albums = self._albums
+        added = [pos for pos in xrange(first, len(albums))
+                 if not pos or albums[pos - 1] != albums[pos]]
+        self._starts.extend(added)
+        if len(removed) + len(added) > len(self._entries) * REBUILD_RATIO:
+            self._entries = sorted(self._entry(pos) for pos in self._starts)
+            self._keys = dict((pos, key) for key, pos, _ in self._entries)
+            self.trie = Trie()
+            for key, _, _ in self._entries:
+                self.trie.add(key)
+            return
+        for pos in removed:
+            key = self._keys.pop(pos)
+            del self._entries[self._search(key, pos)]
+            self.trie.add(key, -1)
+        for pos in added:
+            entry = self._entry(pos)
+            bisect.insort(self._entries, entry)
+            self._keys[pos] = entry[0]
+            self.trie.add(entry[0])
+
+    def _entry(self, pos):
+        """Return entry of album starting at pos."""
+        name = self._albums[pos]
+        ascii = self.transliterate(name) if self.transliterate else name
+        return (sort_key(ascii), pos, name)
+
+    def _search(self, key, pos):
+        """Return index of entry."""
+        return bisect.bisect_left(self._entries, (key, pos))
+
+    def find(self, prefix):
+        """Return index of first album which is not less than prefix."""
+        return max(0, min(bisect.bisect_left(self._entries, (prefix,)),
+                          len(self._entries) - 1))
+
+    def index_of(self, pos):
+        """Return index of album which contains queue position."""
+        start = self._starts[bisect.bisect_right(self._starts, pos) - 1]
+        return self._search(self._keys[start], start)
+
+    def letters(self):
+        """Return sorted first chars of albums."""
+        return self.trie.children()
+
+    def letter_range(self, index):
+        """Return (first index, count) of albums with same first char."""
+        letter = self._entries[index][0][:1]
+        return self.find(letter), self.trie.count(letter)
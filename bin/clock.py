@@ -0,0 +1,46 @@
+"""Monotonic clock.
+
+python2 has no time.monotonic(), so call clock_gettime(CLOCK_MONOTONIC)
+via ctypes. Falls back to time.time() if librt is not available.
+"""
+
+import ctypes
+import os
+import time
+
+
+CLOCK_MONOTONIC = 1
+
+
+class _Timespec(ctypes.Structure):
+
+    """struct timespec."""
+
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+
+def _load_clock_gettime():
+    """Return clock_gettime function or None."""
+    # ctypes.util.find_library spawns ldconfig, use soname directly
+    for name in ['librt.so.1', 'libc.so.6']:
+        try:
+            func = getattr(ctypes.CDLL(name, use_errno=True), 'clock_gettime')
+        except (OSError, AttributeError):
+            continue
+        func.argtypes = [ctypes.c_int, ctypes.POINTER(_Timespec)]
+        return func
+    return None
+
+
+_clock_gettime = _load_clock_gettime()
+
+
+def monotonic():
+    """Return monotonic clock time in sec."""
+    if _clock_gettime is None:
+        return time.time()
+    timespec = _Timespec()
+    if _clock_gettime(CLOCK_MONOTONIC, ctypes.byref(timespec)) != 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno))
+    return timespec.tv_sec + timespec.tv_nsec * 1e-9
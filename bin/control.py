@@ -0,0 +1,219 @@
+"""Local datagram control endpoint and its client.
+
+address is unix datagram socket path, '@name' for abstract unix socket
+or 'host:port' for udp. Only socket path has access control, it is
+owner and group(Server group) writable. Abstract socket is open to any
+local process and udp to any host reaching the port, there is no
+authentication.
+
+    request:  <id> <command> [arg...]
+    reply:    <id> ok <server msec>
+              <id> error <message>
+
+Request with same id from same sender within REPLY_SEC is answered from
+reply cache, so client can resend lost request without running command
+twice. Sender without address(e.g. socat to unix socket) can not be told
+apart and is never cached.
+"""
+
+import collections
+import errno
+import grp
+import os
+import random
+import select
+import socket
+
+import clock
+
+
+DEFAULT_ADDRESS = '/run/mpd-button.sock'
+MAX_SIZE = 512
+REPLY_CACHE = 64
+# longer than resend window of Client
+REPLY_SEC = 10.0
+SOCKET_MODE = 0660
+
+
+class ControlError(Exception):
+
+    """Raised if request is failed or not answered."""
+
+
+def parse_address(address):
+    """Return (socket family, socket address)."""
+    if address.startswith('/'):
+        return socket.AF_UNIX, address
+    if address.startswith('@'):
+        return socket.AF_UNIX, '\0' + address[1:]
+    host, _, port = address.rpartition(':')
+    if not host or not port.isdigit():
+        raise ValueError('unknown control address: %s' % address)
+    return socket.AF_INET, (host, int(port))
+
+
+class Server(object):
+
+    """Run handler(command, args) for each request.
+
+    Consecutive requests of coalesce commands received in one batch
+    run once, they are idempotent(e.g. play/pause).
+    """
+
+    def __init__(self, address, handler, coalesce=(), logger=None,
+                 group=None):
+        """Bind socket, socket path is writable by group name if given."""
+        self.handler = handler
+        self.coalesce = set(coalesce)
+        self.logger = logger
+        family, self._address = parse_address(address)
+        self._sock = socket.socket(family, socket.SOCK_DGRAM)
+        if family == socket.AF_UNIX and not self._address.startswith('\0'):
+            if os.path.exists(self._address):
+                os.unlink(self._address)
+            self._sock.bind(self._address)
+            os.chmod(self._address, SOCKET_MODE)
+            if group:
+                os.chown(self._address, -1, grp.getgrnam(group).gr_gid)
+        else:
+            self._sock.bind(self._address)
+        self._sock.setblocking(False)
+        self._replies = collections.OrderedDict()
+        self.requests = 0
+        self.errors = 0
+        self.latency_max = 0.0
+
+    def fileno(self):
+        """Return socket file descriptor."""
+        return self._sock.fileno()
+
+    def close(self):
+        """Close socket."""
+        self._sock.close()
+        if (isinstance(self._address, str) and
+                self._address.startswith('/') and
+                os.path.exists(self._address)):
+            os.unlink(self._address)
+
+    def _receive(self):
+        """Return all pending (received time, data, sender)."""
+        ret = []
+        while True:
+            try:
+                data, sender = self._sock.recvfrom(MAX_SIZE)
+            except socket.error, err:
+                if err.errno in [errno.EAGAIN, errno.EWOULDBLOCK]:
+                    return ret
+                raise
+            ret.append((clock.monotonic(), data, sender))
+
+    def handle(self):
+        """Run pending requests and send replies."""
+        previous = None
+        for received, data, sender in self._receive():
+            self._expire(received)
+            request_id, _, command = data.strip().partition(' ')
+            key = (sender, request_id)
+            if sender and key in self._replies:
+                self._reply(sender, self._replies[key][1])
+                continue
+            command = command.split()
+            if not command:
+                reply = '%s error empty command' % request_id
+            elif command == previous and command[0] in self.coalesce:
+                reply = '%s ok %.3f' % (
+                    request_id, (clock.monotonic() - received) * 1000)
+            else:
+                reply = self._run(request_id, command, received)
+            previous = command
+            if sender:
+                self._replies[key] = (received, reply)
+                if len(self._replies) > REPLY_CACHE:
+                    self._replies.popitem(last=False)
+            self._reply(sender, reply)
+
+    def _expire(self, now):
+        """Drop cached replies older than REPLY_SEC."""
+        while self._replies:
+            key, (replied, _) = next(self._replies.iteritems())
+            if now - replied < REPLY_SEC:
+                return
+            del self._replies[key]
+
+    def _run(self, request_id, command, received):
+        """Run command and return reply."""
+        self.requests += 1
+        try:
+            self.handler(command[0], command[1:])
+        except Exception, err:
+            self.errors += 1
+            if self.logger:
+                self.logger.warn("control %s failed: %s" % (
+                    ' '.join(command), str(err)))
+            return '%s error %s' % (request_id, str(err).replace('\n', ' '))
+        latency = clock.monotonic() - received
+        if latency > self.latency_max:
+            self.latency_max = latency
+            if self.logger:
+                self.logger.info("max control latency %.1f ms by %s" % (
+                    latency * 1000, ' '.join(command)))
+        return '%s ok %.3f' % (request_id, latency * 1000)
+
+    def _reply(self, sender, reply):
+        """Send reply if sender has address."""
+        if not sender:
+            return
+        try:
+            self._sock.sendto(reply, sender)
+        except socket.error, err:
+            if self.logger:
+                self.logger.debug("control reply failed: %s" % str(err))
+
+
+class Client(object):
+
+    """Send request and wait reply, lost request is resent."""
+
+    def __init__(self, address=DEFAULT_ADDRESS, timeout=1.0, retries=2):
+        """Connect socket."""
+        family, address = parse_address(address)
+        self._sock = socket.socket(family, socket.SOCK_DGRAM)
+        if family == socket.AF_UNIX:
+            # unix datagram sender needs own address to receive reply
+            self._sock.bind('\0mpd-button-ctl-%i-%i' % (
+                os.getpid(), id(self)))
+        self._sock.connect(address)
+        self.timeout = timeout
+        self.retries = retries
+        self._id = random.randint(0, 1 << 30)
+
+    def close(self):
+        """Close socket."""
+        self._sock.close()
+
+    def request(self, command, *args):
+        """Send command and return (server sec, round trip sec)."""
+        self._id += 1
+        request_id = str(self._id)
+        data = ' '.join([request_id, command] + [str(i) for i in args])
+        start = clock.monotonic()
+        for _ in xrange(self.retries + 1):
+            try:
+                self._sock.send(data)
+            except socket.error, err:
+                raise ControlError('request failed: %s' % str(err))
+            deadline = clock.monotonic() + self.timeout
+            while True:
+                timeout = deadline - clock.monotonic()
+                if timeout <= 0 or not select.select(
+                        [self._sock], [], [], timeout)[0]:
+                    break
+                reply = self._sock.recv(MAX_SIZE).split(' ', 2)
+                if reply[0] != request_id:
+                    continue
+                if len(reply) < 3 or reply[1] != 'ok':
+                    raise ControlError(
+                        reply[2] if len(reply) > 2 else 'broken reply')
+                return float(reply[2]) / 1000, clock.monotonic() - start
+        raise ControlError('no reply in %.1f sec' % (
+            self.timeout * (self.retries + 1)))
@@ -0,0 +1,201 @@
+"""Recognize button gestures from timestamped gpio edges.
+
+gestures are written as 'kind:pin', chord is 'chord:pin+pin':
+
+    click:play        press and release
+    double:play       two clicks within double window
+    long:next         hold longer than long window
+    chord:prev+next   press two buttons within chord window
+
+Recognizer only waits for windows of bound gestures: click of a pin
+without double/long binding is decided at press, click of a pin with
+double binding is decided double window after release.
+"""
+
+
+CLICK = 'click'
+DOUBLE = 'double'
+LONG = 'long'
+CHORD = 'chord'
+KINDS = [CLICK, DOUBLE, LONG, CHORD]
+
+
+class GestureError(Exception):
+
+    """Raised if gesture string is broken."""
+
+
+def parse(spec):
+    """Return normalized gesture string."""
+    kind, _, pins = spec.partition(':')
+    pins = pins.split('+')
+    if kind not in KINDS or not all(pins):
+        raise GestureError('unknown gesture: %s' % spec)
+    if (kind == CHORD) != (len(pins) == 2) or len(set(pins)) != len(pins):
+        raise GestureError('chord needs two pins, others one: %s' % spec)
+    return '%s:%s' % (kind, '+'.join(sorted(pins)))
+
+
+class Gesture(object):
+
+    """Recognized gesture.
+
+    latency is sec from the time gesture is completed by user(press,
+    release or long window end) to the time it is decided.
+    """
+
+    def __init__(self, kind, pins, time, completed):
+        """Set gesture data."""
+        self.kind = kind
+        self.pins = tuple(sorted(pins))
+        self.time = time
+        self.latency = time - completed
+
+    def __str__(self):
+        """Return gesture string."""
+        return '%s:%s' % (self.kind, '+'.join(self.pins))
+
+
+class Recognizer(object):
+
+    """Gesture state machine for each pin.
+
+    feed() takes edges in time order and poll() decides gestures whose
+    window is expired, both return list of Gesture. Caller should call
+    poll() at deadline() and feed current pin values after it, edges
+    ignored by debounce are recovered then.
+    """
+
+    DEBOUNCE_SEC = 0.02
+    DOUBLE_SEC = 0.3
+    LONG_SEC = 0.6
+    CHORD_SEC = 0.1
+
+    def __init__(self, pins, bound, debounce_sec=None, double_sec=None,
+                 long_sec=None, chord_sec=None):
+        """Set pin names and bound gesture strings."""
+        self.pins = list(pins)
+        self.bound = set(parse(i) for i in bound)
+        self.debounce_sec = (self.DEBOUNCE_SEC if debounce_sec is None
+                             else debounce_sec)
+        self.double_sec = self.DOUBLE_SEC if double_sec is None else double_sec
+        self.long_sec = self.LONG_SEC if long_sec is None else long_sec
+        self.chord_sec = self.CHORD_SEC if chord_sec is None else chord_sec
+        self._value = dict((pin, False) for pin in self.pins)
+        self._changed = dict((pin, None) for pin in self.pins)
+        self._ignored = set()
+        self._pressed = {}
+        self._consumed = set()
+        # pin: (decide time, completed time) of click waiting window
+        self._pending = {}
+        # pin: release time of first click of double
+        self._released = {}
+
+    def _has(self, kind, pin):
+        """Return True if gesture of pin is bound."""
+        if kind == CHORD:
+            return any(i.startswith(CHORD + ':') and pin in
+                       i.partition(':')[2].split('+') for i in self.bound)
+        return '%s:%s' % (kind, pin) in self.bound
+
+    def latency_bound(self, pin):
+        """Return max sec to wait after click of pin is completed."""
+        if self._has(DOUBLE, pin):
+            return self.double_sec
+        if self._has(LONG, pin):
+            return 0.0
+        return self.chord_sec if self._has(CHORD, pin) else 0.0
+
+    def is_pressed(self, pin):
+        """Return True if pin is pressed."""
+        return pin in self._pressed
+
+    def pressed_time(self, pin):
+        """Return time pin is pressed or None."""
+        return self._pressed.get(pin)
+
+    def feed(self, now, pin, value):
+        """Update pin value and return decided gestures."""
+        value = bool(value)
+        if self._value[pin] == value:
+            self._ignored.discard(pin)
+            return []
+        changed = self._changed[pin]
+        if changed is not None and now - changed < self.debounce_sec:
+            self._ignored.add(pin)
+            return []
+        self._ignored.discard(pin)
+        self._value[pin] = value
+        self._changed[pin] = now
+        ret = self.poll(now)
+        if value:
+            ret.extend(self._press(now, pin))
+        else:
+            ret.extend(self._release(now, pin))
+        return ret
+
+    def _press(self, now, pin):
+        """Decide chord/double/click at press."""
+        self._pressed[pin] = now
+        self._consumed.discard(pin)
+        for other, pressed in self._pressed.items():
+            if (other == pin or other in self._consumed or
+                    now - pressed > self.chord_sec):
+                continue
+            key = '%s:%s' % (CHORD, '+'.join(sorted([pin, other])))
+            if key in self.bound:
+                self._consumed.update([pin, other])
+                self._pending.pop(other, None)
+                self._released.pop(other, None)
+                return [Gesture(CHORD, [pin, other], now, now)]
+        if pin in self._released:
+            del self._released[pin]
+            self._pending.pop(pin, None)
+            self._consumed.add(pin)
+            return [Gesture(DOUBLE, [pin], now, now)]
+        if self._has(DOUBLE, pin) or self._has(LONG, pin):
+            return []
+        if self._has(CHORD, pin):
+            self._pending[pin] = (now + self.chord_sec, now)
+            return []
+        return [Gesture(CLICK, [pin], now, now)]
+
+    def _release(self, now, pin):
+        """Decide click at release."""
+        del self._pressed[pin]
+        if pin in self._consumed:
+            self._consumed.discard(pin)
+            return []
+        if self._has(DOUBLE, pin):
+            self._released[pin] = now
+            self._pending[pin] = (now + self.double_sec, now)
+            return []
+        if self._has(LONG, pin):
+            return [Gesture(CLICK, [pin], now, now)]
+        return []
+
+    def poll(self, now):
+        """Return gestures whose window is expired."""
+        ret = []
+        for pin, pressed in sorted(self._pressed.items(), key=lambda i: i[1]):
+            if (pin not in self._consumed and self._has(LONG, pin) and
+                    now >= pressed + self.long_sec):
+                self._consumed.add(pin)
+                ret.append(Gesture(LONG, [pin], now, pressed + self.long_sec))
+        for pin, (deadline, completed) in sorted(self._pending.items(),
+                                                 key=lambda i: i[1]):
+            if now >= deadline:
+                del self._pending[pin]
+                self._released.pop(pin, None)
+                ret.append(Gesture(CLICK, [pin], now, completed))
+        return ret
+
+    def deadline(self):
+        """Return time poll() should be called or None."""
+        times = [deadline for deadline, _ in self._pending.values()]
+        times.extend(pressed + self.long_sec
+                     for pin, pressed in self._pressed.items()
+                     if pin not in self._consumed and self._has(LONG, pin))
+        times.extend(self._changed[pin] + self.debounce_sec
+                     for pin in self._ignored)
+        return min(times) if times else None
@@ -0,0 +1,83 @@
+"""Compact binary trace of timestamped gpio edge events.
+
+file layout(little endian):
+
+    header:  magic 'GPTR', version(uint8), pin count(uint8)
+    pins:    name length(uint8) + name, for each pin
+    records: timestamp(double) + pin index(uint8) + value(uint8)
+"""
+
+import struct
+
+
+MAGIC = 'GPTR'
+VERSION = 1
+
+_HEADER = struct.Struct('<4sBB')
+_NAME_LENGTH = struct.Struct('<B')
+_RECORD = struct.Struct('<dBB')
+
+
+class TraceError(Exception):
+
+    """Raised if trace file is broken."""
+
+
+class TraceWriter(object):
+
+    """Write gpio edge events to trace file."""
+
+    def __init__(self, f, names):
+        """Write trace header for given pin names."""
+        self._f = f
+        self.names = list(names)
+        self._index = dict((name, i) for i, name in enumerate(self.names))
+        self._f.write(_HEADER.pack(MAGIC, VERSION, len(self.names)))
+        for name in self.names:
+            self._f.write(_NAME_LENGTH.pack(len(name)))
+            self._f.write(name)
+
+    def write(self, timestamp, name, value):
+        """Append edge event."""
+        self._f.write(_RECORD.pack(timestamp, self._index[name], int(value)))
+
+    def flush(self):
+        """Flush buffered events."""
+        self._f.flush()
+
+
+class TraceReader(object):
+
+    """Read gpio edge events from trace file."""
+
+    def __init__(self, f):
+        """Read trace header."""
+        self._f = f
+        header = self._f.read(_HEADER.size)
+        if len(header) != _HEADER.size:
+            raise TraceError('truncated header')
+        magic, version, count = _HEADER.unpack(header)
+        if magic != MAGIC:
+            raise TraceError('not a gpio trace file')
+        if version != VERSION:
+            raise TraceError('unsupported trace version: %i' % version)
+        self.names = []
+        for _ in xrange(count):
+            length, = _NAME_LENGTH.unpack(self._f.read(_NAME_LENGTH.size))
+            self.names.append(self._f.read(length))
+
+    def __iter__(self):
+        """Yield (timestamp, pin name, value) for each edge event."""
+        while True:
+            data = self._f.read(_RECORD.size)
+            if len(data) < _RECORD.size:
+                return
+            timestamp, index, value = _RECORD.unpack(data)
+            yield timestamp, self.names[index], value
+
+
+def load(path):
+    """Return pin names and edge event list from trace file."""
+    with open(path, 'rb') as f:
+        reader = TraceReader(f)
+        return reader.names, list(reader)
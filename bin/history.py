@@ -0,0 +1,292 @@
+"""Append-only play history file.
+
+file layout(little endian):
+
+    header:  magic 'PHST', version(uint8)
+    records: type(uint8) + body
+             'S' string: id(uint32) + length(uint16) + bytes
+             'P' play:   start unix time(uint32), listened sec(float32),
+                         length sec(float32), end reason(uint8),
+                         cause, file, album, artist, title string ids
+                         (uint32, 0 is empty string)
+
+strings are written once at first use, so a play costs 34 bytes.
+Truncated or garbage tail of power loss while writing(e.g. zero filled
+block) is cut by Recorder, file with unknown header is moved to
+path + '.bad' and new file is started.
+"""
+
+import os
+import struct
+import threading
+import time
+
+
+DEFAULT_PATH = '/var/lib/mpd-history/history.bin'
+MAGIC = 'PHST'
+VERSION = 1
+
+FINISHED = 0
+SKIPPED = 1
+STOPPED = 2
+REASONS = {FINISHED: 'finished', SKIPPED: 'skipped', STOPPED: 'stopped'}
+
+_HEADER = struct.Struct('<4sB')
+_TYPE = struct.Struct('<c')
+_STRING = struct.Struct('<IH')
+_PLAY = struct.Struct('<IffBIIIII')
+_STRING_FIELDS = ['cause', 'file', 'album', 'artist', 'title']
+
+
+class HistoryError(Exception):
+
+    """Raised if history file is broken."""
+
+
+class Play(object):
+
+    """One played song."""
+
+    __slots__ = ['start', 'listened', 'length', 'reason'] + _STRING_FIELDS
+
+    def __init__(self, start, listened, length, reason, cause='', file='',
+                 album='', artist='', title=''):
+        """Set play data."""
+        self.start = start
+        self.listened = listened
+        self.length = length
+        self.reason = reason
+        self.cause = cause
+        self.file = file
+        self.album = album
+        self.artist = artist
+        self.title = title
+
+
+def _records(f, strict=True):
+    """Yield (type, body, end offset) of complete records.
+
+    Unknown record type raises HistoryError, ends records if not strict.
+    """
+    header = f.read(_HEADER.size)
+    if len(header) < _HEADER.size:
+        return
+    magic, version = _HEADER.unpack(header)
+    if magic != MAGIC or version != VERSION:
+        raise HistoryError('unknown history file')
+    offset = _HEADER.size
+    while True:
+        kind = f.read(_TYPE.size)
+        if not kind:
+            return
+        if kind == 'S':
+            head = f.read(_STRING.size)
+            if len(head) < _STRING.size:
+                return
+            string_id, length = _STRING.unpack(head)
+            text = f.read(length)
+            if len(text) < length:
+                return
+            offset += _TYPE.size + _STRING.size + length
+            yield kind, (string_id, text), offset
+        elif kind == 'P':
+            body = f.read(_PLAY.size)
+            if len(body) < _PLAY.size:
+                return
+            offset += _TYPE.size + _PLAY.size
+            yield kind, _PLAY.unpack(body), offset
+        elif strict:
+            raise HistoryError('unknown record type at %i' % offset)
+        else:
+            return
+
+
+def read(f):
+    """Yield Play of history file object."""
+    strings = {0: ''}
+    for kind, body, _ in _records(f):
+        if kind == 'S':
+            strings[body[0]] = body[1]
+            continue
+        yield Play(*(body[:4] + tuple(strings.get(i, '') for i in body[4:])))
+
+
+class Recorder(object):
+
+    """Buffer play records and append them to history file.
+
+    Records are written with fsync by flush(), caller calls it at most
+    every few minutes to spare sd card, records of latest minutes are lost
+    at power loss.
+    """
+
+    BATCH = 256
+    # oldest plays are dropped while file can not be written
+    MAX_PENDING = 4096
+
+    def __init__(self, path=DEFAULT_PATH):
+        """Set path, file is opened at first flush."""
+        self.path = path
+        self._lock = threading.Lock()
+        self._buffer = []
+        self._strings = {'': 0}
+        self._size = None
+        self.written = 0
+
+    def _open(self):
+        """Load string ids of existing file."""
+        dirname = os.path.dirname(self.path)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        try:
+            self._size = self._load()
+        except HistoryError:
+            # header is broken, keep file for inspection
+            os.rename(self.path, self.path + '.bad')
+            self._size = self._load()
+
+    def _load(self):
+        """Load string ids and return size of good records."""
+        self._strings = {'': 0}
+        size = 0
+        if os.path.exists(self.path):
+            with open(self.path, 'rb') as f:
+                for kind, body, size in _records(f, strict=False):
+                    if kind == 'S':
+                        self._strings[body[1]] = body[0]
+        return size
+
+    def _string_id(self, text, records):
+        """Return string id, new string record is added to records."""
+        string_id = self._strings.get(text)
+        if string_id is None:
+            string_id = len(self._strings)
+            self._strings[text] = string_id
+            records.append('S' + _STRING.pack(string_id, len(text)) + text)
+        return string_id
+
+    def add(self, play):
+        """Buffer play, return True if buffer should be flushed."""
+        with self._lock:
+            self._buffer.append(play)
+            del self._buffer[:-self.MAX_PENDING]
+            return len(self._buffer) >= self.BATCH
+
+    def pending(self):
+        """Return buffered play count."""
+        return len(self._buffer)
+
+    def flush(self):
+        """Append buffered plays to file with fsync."""
+        with self._lock:
+            plays, self._buffer = self._buffer, []
+        if not plays:
+            return
+        try:
+            self._write(plays)
+        except Exception:
+            # keep plays for next flush, string ids are reloaded
+            with self._lock:
+                self._buffer[:0] = plays
+            self._size = None
+            raise
+        self.written += len(plays)
+
+    def _write(self, plays):
+        """Append plays to file with fsync."""
+        if self._size is None:
+            self._open()
+        records = []
+        for play in plays:
+            ids = [self._string_id(getattr(play, i)[:0xffff], records)
+                   for i in _STRING_FIELDS]
+            records.append('P' + _PLAY.pack(
+                int(play.start), play.listened, play.length, play.reason,
+                *ids))
+        fd = os.open(self.path, os.O_WRONLY | os.O_CREAT, 0644)
+        try:
+            if not self._size:
+                os.ftruncate(fd, 0)
+                os.write(fd, _HEADER.pack(MAGIC, VERSION))
+                self._size = _HEADER.size
+            # cut truncated record of last power loss
+            os.ftruncate(fd, self._size)
+            os.lseek(fd, self._size, os.SEEK_SET)
+            data = ''.join(records)
+            os.write(fd, data)
+            os.fsync(fd)
+            self._size += len(data)
+        finally:
+            os.close(fd)
+
+
+class Tracker(object):
+
+    """Make Play from player events of current song.
+
+    listened is monotonic sec while playing, so seek does not count.
+    Song ended before END_MARGIN_SEC of its length is skipped, cause is
+    taken from cause() called within CAUSE_SEC before song change.
+    """
+
+    END_MARGIN_SEC = 5.0
+    CAUSE_SEC = 5.0
+
+    def __init__(self, recorder):
+        """Set recorder."""
+        self.recorder = recorder
+        self._play = None
+        # monotonic time playing is resumed, None while paused
+        self._resumed = None
+        # (elapsed, monotonic time) of latest status
+        self._position = None
+        self._cause = None
+
+    def start(self, song, playing, now, wall=None):
+        """Start play of song dict(file, album, artist, title, length)."""
+        if self._play is not None:
+            self.end(now)
+        self._play = Play(time.time() if wall is None else wall, 0.0,
+                          song.get('length', 0.0), FINISHED, '',
+                          song.get('file', ''), song.get('album', ''),
+                          song.get('artist', ''), song.get('title', ''))
+        self._resumed = now if playing else None
+        self._position = (song.get('time_elapsed', 0.0), now)
+
+    def is_playing(self):
+        """Return True if song play is started."""
+        return self._play is not None
+
+    def progress(self, elapsed, playing, now):
+        """Update elapsed time and pause/resume."""
+        if self._play is None:
+            return
+        if playing and self._resumed is None:
+            self._resumed = now
+        elif not playing and self._resumed is not None:
+            self._play.listened += now - self._resumed
+            self._resumed = None
+        self._position = (elapsed, now)
+
+    def cause(self, name, now):
+        """Set name of next song change cause(e.g. 'button:next')."""
+        self._cause = (name, now)
+
+    def end(self, now, stopped=False):
+        """Finish play and return True if recorder should be flushed."""
+        play, self._play = self._play, None
+        if play is None:
+            return False
+        elapsed, updated = self._position
+        if self._resumed is not None:
+            play.listened += now - self._resumed
+            elapsed += now - updated
+        cause, self._cause = self._cause or (None, None), None
+        if cause[0] is not None and now - cause[1] <= self.CAUSE_SEC:
+            play.reason = SKIPPED
+            play.cause = cause[0]
+        elif play.length and elapsed >= play.length - self.END_MARGIN_SEC:
+            play.reason = FINISHED
+        else:
+            play.reason = STOPPED if stopped else SKIPPED
+        return self.recorder.add(play)
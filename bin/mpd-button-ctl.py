@@ -0,0 +1,54 @@
+#!/usr/bin/python2
+
+"""Send command to mpd-button control endpoint.
+
+    $ mpd-button-ctl next
+    $ mpd-button-ctl seek -- -10
+    $ mpd-button-ctl --count 100 play
+"""
+
+
+import argparse
+import sys
+
+import control
+
+
+def main():
+    """Send command and show latency."""
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('command', help='prev_album, prev, pause, play,'
+                        ' next, next_album, browse or seek SEC')
+    parser.add_argument('args', nargs='*', help='command arguments')
+    parser.add_argument(
+        '--address', default=control.DEFAULT_ADDRESS,
+        help='control endpoint(default: %(default)s)')
+    parser.add_argument('--timeout', type=float, default=1.0,
+                        help='reply timeout sec for each try')
+    parser.add_argument('--count', type=int, default=1,
+                        help='repeat command to measure latency')
+    args = parser.parse_args()
+    client = control.Client(args.address, args.timeout)
+    server, total = [], []
+    try:
+        for _ in xrange(args.count):
+            server_sec, total_sec = client.request(args.command, *args.args)
+            server.append(server_sec)
+            total.append(total_sec)
+    except control.ControlError, err:
+        sys.stderr.write('%s\n' % str(err))
+        sys.exit(1)
+    finally:
+        client.close()
+
+    def ms(values):
+        values = sorted(values)
+        return 'min %.2f median %.2f max %.2f ms' % (
+            values[0] * 1000, values[len(values) / 2] * 1000,
+            values[-1] * 1000)
+    print 'server: %s' % ms(server)
+    print 'round trip: %s' % ms(total)
+
+if __name__ == '__main__':
+    main()
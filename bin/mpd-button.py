@@ -3,14 +3,30 @@
 """RotarySwitch for mpd control."""
 
 
+import argparse
+import errno
 import os
 import select
-import subprocess
 import time
 import logging
-import traceback
 import signal
 import sys
+import threading
+
+import albumindex
+import clock
+import control
+import gesture
+import gpiotrace
+import mpdclient
+import ringlog
+import romaji
+
+
+# mpd-lcd-i2c shows text sent to this client to client message channel
+LCD_CHANNEL = 'mpd-lcd'
+# mpd-lcd-i2c play history takes "skip<TAB>cause" before song change
+HISTORY_CHANNEL = 'mpd-history'
 
 
 class MPD():
@@ -21,6 +37,7 @@ class MPD():
         """Initialize thread."""
         self.logger = logger if logger else logging
         self.playlist = []
+        self.client = mpdclient.MPDClient(logger=self.logger)
 
     def prev_album(self):
         """Play prev album song."""
@@ -36,37 +53,31 @@ class MPD():
                 self.logger.info("set current album: %s" % current_album)
                 continue
             if not current_album == song['album']:
-                new_pos = pos - prev_count + 1
-                subprocess.check_output(
-                    ['/usr/bin/mpc', 'play', str(new_pos)])
+                new_pos = pos - prev_count
+                self.client.command('play', new_pos)
                 self.logger.info("play %i" % new_pos)
                 return
-        subprocess.check_output(
-            ['/usr/bin/mpc', 'play', '1'])
+        self.client.command('play', 0)
 
     def prev(self):
         """Play prev song."""
         self.logger.info("prev")
-        subprocess.check_output(
-            ['/usr/bin/mpc', 'prev'])
+        self.client.command('previous')
 
     def pause(self):
         """Pause song."""
         self.logger.info("pause")
-        subprocess.check_output(
-            ['/usr/bin/mpc', 'pause'])
+        self.client.command('pause', 1)
 
     def play(self):
         """Play song."""
         self.logger.info("play")
-        subprocess.check_output(
-            ['/usr/bin/mpc', 'play'])
+        self.client.command('play')
 
     def next(self):
         """Play next song."""
         self.logger.info("next")
-        subprocess.check_output(
-            ['/usr/bin/mpc', 'next'])
+        self.client.command('next')
 
     def next_album(self):
         """Play prev album song."""
@@ -78,44 +89,320 @@ class MPD():
         for next_count, song in enumerate(playlist[pos:]):
             if not current_album == song['album']:
                 self.logger.info("new album: %s" % song['album'])
-                new_pos = pos + next_count + 1
-                subprocess.check_output(
-                    ['/usr/bin/mpc', 'play', str(new_pos)])
+                new_pos = pos + next_count
+                self.client.command('play', new_pos)
                 self.logger.info("play %i" % new_pos)
                 return
-        subprocess.check_output(
-            ['/usr/bin/mpc', 'play', '1'])
+        self.client.command('play', 0)
+
+    def skip_cause(self, cause):
+        """Tell play history the cause of next song change."""
+        send_message(self.client, HISTORY_CHANNEL, 'skip\t%s' % cause,
+                     self.logger)
+
+    def seek(self, sec):
+        """Seek current song relatively."""
+        self.logger.debug("seek %+i" % sec)
+        try:
+            self.client.command('seekcur', '%+i' % sec)
+        except mpdclient.MPDError, err:
+            # seek over song head/tail, keep seeking while button is held
+            self.logger.debug("seek failed: %s" % str(err))
 
     def get_playlist(self):
         """Return playlist."""
-        out = subprocess.check_output(
-            ['/usr/bin/mpc', 'playlist', '-f', '%album%'])
-        return [{'album': i} for i in out.splitlines()]
+        return [{'album': i.get('Album', '')}
+                for i in self.client.songs('playlistinfo')]
 
     def get_position(self):
         """Return playlist playing position."""
-        out = subprocess.check_output(
-            ['/usr/bin/mpc', '-f', '%position%'])
-        return int(out.splitlines()[0]) - 1
+        return int(self.client.status()['song'])
+
+
+class Browser(object):
+
+    """Jump to album from sorted album index of mpd queue.
+
+    Candidates are shown on mpd-lcd-i2c by client to client message.
+    """
+
+    TIMEOUT_SEC = 15
+
+    def __init__(self, client, logger=None):
+        """Create empty album index, it is built at first browse."""
+        self.logger = logger if logger else logging
+        self.client = client
+        store = romaji.Store()
+        self.index = albumindex.AlbumIndex(
+            lambda name: store.get(name, name))
+        self.cursor = 0
+        self._until = None
+
+    def is_active(self):
+        """Return True if browse mode is started."""
+        return self._until is not None
+
+    def deadline(self):
+        """Return time browse mode ends or None."""
+        return self._until
+
+    def poll(self, now):
+        """End browse mode if no button is pressed for TIMEOUT_SEC."""
+        if self._until is not None and now >= self._until:
+            self.end(now)
+
+    def start(self, now):
+        """Start browse mode from current album."""
+        if self.index.update(self.client):
+            self.logger.info("album index updated: %i albums" % len(
+                self.index))
+        if not len(self.index):
+            return
+        status = self.client.status()
+        self.cursor = self.index.index_of(int(status.get('song', 0)))
+        self.show(now)
+
+    def prev_album(self, now):
+        """Move to prev album."""
+        self.cursor = (self.cursor - 1) % len(self.index)
+        self.show(now)
+
+    def next_album(self, now):
+        """Move to next album."""
+        self.cursor = (self.cursor + 1) % len(self.index)
+        self.show(now)
+
+    def prev_letter(self, now):
+        """Move to head of current letter or prev letter."""
+        first, _ = self.index.letter_range(self.cursor)
+        if first == self.cursor:
+            first, _ = self.index.letter_range(
+                (self.cursor - 1) % len(self.index))
+        self.cursor = first
+        self.show(now)
+
+    def next_letter(self, now):
+        """Move to head of next letter."""
+        first, count = self.index.letter_range(self.cursor)
+        self.cursor = (first + count) % len(self.index)
+        self.show(now)
+
+    def select(self, now):
+        """Play first song of album."""
+        key, pos, name = self.index[self.cursor]
+        if self.index.update(self.client):
+            # queue is changed while browsing
+            self.cursor = self.index.find(key)
+            key, pos, name = self.index[self.cursor]
+        self.logger.info("play album %s at %i" % (name, pos))
+        send_message(self.client, HISTORY_CHANNEL, 'skip\tbrowse',
+                     self.logger)
+        self.client.command('play', pos)
+        self.end(now)
+
+    def end(self, now):
+        """End browse mode."""
+        self._until = None
+        self._send('release')
+
+    def show(self, now):
+        """Show current album and its position in letter."""
+        self._until = now + self.TIMEOUT_SEC
+        key, _, _ = self.index[self.cursor]
+        first, count = self.index.letter_range(self.cursor)
+        self._send('show\t%s\t%s %i/%i' % (
+            key, key[:1], self.cursor - first + 1, count))
+
+    def _send(self, message):
+        """Send message to mpd-lcd-i2c."""
+        send_message(self.client, LCD_CHANNEL, message, self.logger)
+
+
+def send_message(client, channel, message, logger):
+    """Send client to client message, ignored if nobody subscribes."""
+    try:
+        client.command('sendmessage', channel, message)
+    except mpdclient.MPDError, err:
+        # mpd-lcd-i2c is not running
+        if err.reason != mpdclient.PROTOCOL_ERROR:
+            raise
+        logger.debug("send message failed: %s" % str(err))
+
+
+class Volume(threading.Thread):
+
+    """Change mpd volume by rotary encoder detents.
+
+    Detents added while previous change is in flight are coalesced into
+    next single change. Change is relative(volume command), so volume set
+    by other clients meanwhile is kept and mpd clamps it to 0-100.
+    """
+
+    STEP = 2
+
+    def __init__(self, logger=None):
+        """Open own mpd connection."""
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        self.logger = logger if logger else logging
+        self.client = mpdclient.MPDClient(logger=self.logger)
+        self._lock = threading.Lock()
+        self._changed = threading.Event()
+        self._detents = 0
+
+    def add(self, detents):
+        """Add detents to next volume change."""
+        with self._lock:
+            self._detents += detents
+        self._changed.set()
+
+    def run(self):
+        """Send coalesced volume change."""
+        while True:
+            self._changed.wait()
+            with self._lock:
+                self._changed.clear()
+                detents = self._detents
+                self._detents = 0
+            if not detents:
+                continue
+            try:
+                self.client.command('volume', detents * self.STEP)
+                self.logger.debug("volume %+i" % (detents * self.STEP))
+            except mpdclient.MPDError, err:
+                self.logger.warn("volume change failed: %s" % str(err))
+
+
+class RotaryEncoder(threading.Thread):
+
+    """Quadrature rotary encoder decoder."""
+
+    STEPS_PER_DETENT = 4
+    # (prev a, prev b, a, b) gray code transitions to step
+    TRANSITIONS = {
+        (0, 0, 0, 1): 1, (0, 1, 1, 1): 1, (1, 1, 1, 0): 1, (1, 0, 0, 0): 1,
+        (0, 0, 1, 0): -1, (1, 0, 1, 1): -1, (1, 1, 0, 1): -1, (0, 1, 0, 0): -1,
+    }
+
+    def __init__(self, pin_a, pin_b, callback, logger=None):
+        """Set gpio value files opened with both edge."""
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        self.logger = logger if logger else logging
+        self._pin_a = pin_a
+        self._pin_b = pin_b
+        self._callback = callback
+        self._state = None
+        self._direction = 0
+        self._steps = 0
+
+    def _gpio_read(self, f):
+        """read gpio value."""
+        f.seek(0)
+        return int(f.read().strip())
+
+    def decode(self, a, b):
+        """Update step count by new pin state and call back with detents.
+
+        Both pins changed since last read means 2 steps are missed by slow
+        reader, count them in last known direction.
+        """
+        state = (a, b)
+        if self._state is None or state == self._state:
+            self._state = state
+            return
+        step = self.TRANSITIONS.get(self._state + state)
+        self._state = state
+        if step is None:
+            step = 2 * self._direction
+        else:
+            self._direction = step
+        self._steps += step
+        detents = int(float(self._steps) / self.STEPS_PER_DETENT)
+        if detents:
+            self._steps -= detents * self.STEPS_PER_DETENT
+            self._callback(detents)
+
+    def run(self):
+        """Decode pin changes."""
+        epoll = select.epoll()
+        epoll.register(self._pin_a, select.EPOLLIN | select.EPOLLET)
+        epoll.register(self._pin_b, select.EPOLLIN | select.EPOLLET)
+        try:
+            while True:
+                if epoll_poll(epoll):
+                    self.decode(self._gpio_read(self._pin_a),
+                                self._gpio_read(self._pin_b))
+        finally:
+            epoll.unregister(self._pin_a)
+            epoll.unregister(self._pin_b)
 
 
 class App(object):
 
     """RotarySwitch for mpd control."""
 
+    # (held sec, seek interval sec, seek sec) while prev/next is held
+    SEEK_RATE = [(0.6, 0.3, 3), (2.0, 0.2, 5), (4.0, 0.2, 10), (8.0, 0.2, 30)]
+    BINDINGS = {
+        'click:prev_album': 'prev_album',
+        'click:prev': 'prev',
+        'long:prev': 'seek_back',
+        'click:pause': 'pause',
+        'click:play': 'play',
+        'click:next': 'next',
+        'long:next': 'seek_forward',
+        'click:next_album': 'next_album',
+        'long:pause': 'browse',
+    }
+    ACTIONS = ['prev_album', 'prev', 'pause', 'play', 'next', 'next_album',
+               'seek_back', 'seek_forward', 'browse']
+    # commands of control endpoint, seek takes relative sec
+    REMOTE_ACTIONS = ['prev_album', 'prev', 'pause', 'play', 'next',
+                      'next_album', 'browse', 'seek']
+    # actions which change song, play history records their cause
+    SKIP_ACTIONS = ['prev_album', 'prev', 'next', 'next_album']
+    # Browser methods while browse mode
+    BROWSE_BINDINGS = {
+        'click:prev_album': 'prev_letter',
+        'click:prev': 'prev_album',
+        'click:pause': 'end',
+        'click:play': 'select',
+        'click:next': 'next_album',
+        'click:next_album': 'next_letter',
+    }
+
     def __init__(self, prev_album, prev, pause, play, next, next_album,
-                 logger=None):
-        """Open gpio for prev/play/next button."""
+                 logger=None, bindings=None, windows=None):
+        """Open gpio for prev/play/next button.
+
+        bindings is dict of gesture string to ACTIONS name, windows is
+        keyword arguments of gesture.Recognizer.
+        """
         self.mpd = MPD(logger)
         self.logger = logger if logger else logging
         self.logger.info("start app")
-        self._prev_album = prev_album
-        self._prev = prev
-        self._pause = pause
-        self._play = play
-        self._next = next
-        self._next_album = next_album
-        self._last = self._pause
+        self._pins = [('prev_album', prev_album), ('prev', prev),
+                      ('pause', pause), ('play', play),
+                      ('next', next), ('next_album', next_album)]
+        bindings = self.BINDINGS if bindings is None else bindings
+        self._bindings = dict((gesture.parse(key), value)
+                              for key, value in bindings.items())
+        for action in self._bindings.values():
+            if action not in self.ACTIONS:
+                raise ValueError('unknown action: %s' % action)
+        self.recognizer = gesture.Recognizer(
+            [name for name, _ in self._pins],
+            set(self._bindings).union(self.BROWSE_BINDINGS),
+            **(windows or {}))
+        self.browser = Browser(self.mpd.client, self.logger)
+        for name, _ in self._pins:
+            self.logger.info("%s decision latency bound: %.3f sec" % (
+                name, self.recognizer.latency_bound(name)))
+        self.latency_max = 0.0
+        # held prev/next button: (pin name, seek direction, pressed time)
+        self._hold = None
+        self._hold_next_seek = 0.0
         signal.signal(signal.SIGTERM, self.exit)
         signal.signal(signal.SIGINT, self.exit)
 
@@ -130,64 +417,157 @@ class App(object):
         out = f.read().strip()
         return out
 
-    def run(self):
-        """Wait gpio value is changed."""
+    def feed(self, now, name, value):
+        """Feed pin edge and run mpd command for decided gesture."""
+        for decided in self.recognizer.feed(now, name, value):
+            self.perform(decided)
+
+    def poll(self, now):
+        """Run expired gestures and seek steps."""
+        for decided in self.recognizer.poll(now):
+            self.perform(decided)
+        self.hold_step(now)
+        self.browser.poll(now)
+
+    def deadline(self):
+        """Return time poll() should be called or None."""
+        times = [i for i in [self.recognizer.deadline(), self.hold_deadline(),
+                             self.browser.deadline()]
+                 if i is not None]
+        return min(times) if times else None
+
+    def perform(self, decided):
+        """Run action bound to gesture."""
+        self.logger.debug("%s latency %.1f ms" % (
+            decided, decided.latency * 1000))
+        if decided.latency > self.latency_max:
+            self.latency_max = decided.latency
+            self.logger.info("max decision latency %.1f ms by %s" % (
+                decided.latency * 1000, decided))
+        if self.browser.is_active():
+            action = self.BROWSE_BINDINGS.get(str(decided))
+            if action:
+                getattr(self.browser, action)(decided.time)
+            return
+        action = self._bindings.get(str(decided))
+        if action == 'seek_back':
+            self._press_hold(decided.pins[0], -1)
+        elif action == 'seek_forward':
+            self._press_hold(decided.pins[0], 1)
+        elif action:
+            self.command(action, [], decided.time, str(decided))
+
+    def command(self, action, args, now=None, cause=None):
+        """Run mpd action by button gesture or control request.
+
+        cause is gesture string, None is control request.
+        """
+        if action in self.SKIP_ACTIONS:
+            self.mpd.skip_cause(cause or 'control:%s' % action)
+        if action == 'browse':
+            self.browser.start(clock.monotonic() if now is None else now)
+        elif action == 'seek':
+            self.mpd.seek(int(args[0]))
+        elif action in self.REMOTE_ACTIONS:
+            getattr(self.mpd, action)()
+        else:
+            raise ValueError('unknown command: %s' % action)
+
+    def _press_hold(self, name, direction):
+        """Start seeking while prev/next button is held."""
+        pressed = self.recognizer.pressed_time(name)
+        if pressed is None:
+            return
+        self._hold = (name, direction, pressed)
+        self._hold_next_seek = pressed + self.SEEK_RATE[0][0]
+
+    def hold_deadline(self):
+        """Return time to next seek step or None if no button is held."""
+        return self._hold_next_seek if self._hold else None
+
+    def hold_step(self, now):
+        """Seek current song if prev/next is held and step time is come."""
+        if not self._hold:
+            return
+        name, direction, pressed = self._hold
+        if self.recognizer.pressed_time(name) != pressed:
+            self._hold = None
+            return
+        if now < self._hold_next_seek:
+            return
+        interval, sec = self.SEEK_RATE[0][1:]
+        for held, rate_interval, rate_sec in self.SEEK_RATE:
+            if now - pressed >= held:
+                interval, sec = rate_interval, rate_sec
+        self.mpd.seek(direction * sec)
+        self._hold_next_seek = now + interval
+
+    def run(self, server=None):
+        """Wait gpio value is changed or control request.
+
+        server(control.Server) runs requests by App.command.
+        """
         epoll = select.epoll()
-        epoll.register(self._prev_album,
-                       select.EPOLLIN | select.EPOLLET)
-        epoll.register(self._prev,
-                       select.EPOLLIN | select.EPOLLET)
-        epoll.register(self._pause,
-                       select.EPOLLIN | select.EPOLLET)
-        epoll.register(self._play,
-                       select.EPOLLIN | select.EPOLLET)
-        epoll.register(self._next,
-                       select.EPOLLIN | select.EPOLLET)
-        epoll.register(self._next_album,
-                       select.EPOLLIN | select.EPOLLET)
+        for _, f in self._pins:
+            epoll.register(f, select.EPOLLIN | select.EPOLLET)
+        if server:
+            epoll.register(server, select.EPOLLIN)
         try:
             while True:
                 try:
-                    time.sleep(0.1)
-                    for fileno, event in epoll.poll():
-                        if self._gpio_read(self._prev_album) == '1':
-                            if not self._last == self._prev_album:
-                                self.mpd.prev_album()
-                            self._last = self._prev_album
-                        if self._gpio_read(self._prev) == '1':
-                            if self._last not in [self._prev_album,
-                                                  self._prev]:
-                                self.mpd.prev()
-                            self._last = self._prev
-                        if self._gpio_read(self._pause) == '1':
-                            if (self._last not in [self._prev,
-                                                   self._prev_album]):
-                                self.mpd.pause()
-                            self._last = self._pause
-                        if self._gpio_read(self._play) == '1':
-                            self.mpd.play()
-                            self._last = self._play
-                        if self._gpio_read(self._next_album) == '1':
-                            if not self._last == self._next_album:
-                                self.mpd.next_album()
-                            self._last = self._next_album
-                        if self._gpio_read(self._next) == '1':
-                            if self._last not in [self._next,
-                                                  self._next_album]:
-                                self.mpd.next()
-                            self._last = self._next
-
-                except subprocess.CalledProcessError:
-                    time.sleep(1)
-                except IndexError:
-                    time.sleep(1)
+                    deadline = self.deadline()
+                    timeout = (-1 if deadline is None else
+                               max(0, deadline - clock.monotonic()))
+                    events = epoll_poll(epoll, timeout)
+                    if server and any(fileno == server.fileno()
+                                      for fileno, _ in events):
+                        server.handle()
+                    now = clock.monotonic()
+                    # read all pins, edges ignored by debounce are
+                    # recovered here
+                    for name, f in self._pins:
+                        self.feed(now, name, self._gpio_read(f) == '1')
+                    self.poll(now)
+                except mpdclient.MPDError, err:
+                    self.logger.warn("mpd command failed: %s" % str(err))
+                except (KeyError, IndexError):
+                    self.logger.warn("no song to play")
         finally:
-            epoll.unregister(self._prev_album)
-            epoll.unregister(self._prev)
-            epoll.unregister(self._pause)
-            epoll.unregister(self._play)
-            epoll.unregister(self._next)
-            epoll.unregister(self._next_album)
+            for _, f in self._pins:
+                epoll.unregister(f)
+            if server:
+                epoll.unregister(server)
+                server.close()
+
+    def record(self, path):
+        """Record gpio edge events to trace file instead of mpd control."""
+        self.logger.info("record gpio events to %s" % path)
+        names = dict((f.fileno(), name) for name, f in self._pins)
+        files = dict((f.fileno(), f) for _, f in self._pins)
+        epoll = select.epoll()
+        for _, f in self._pins:
+            epoll.register(f, select.EPOLLIN | select.EPOLLET)
+        with open(path, 'wb') as f:
+            trace = gpiotrace.TraceWriter(f, [name for name, _ in self._pins])
+            try:
+                while True:
+                    for fileno, event in epoll_poll(epoll):
+                        value = self._gpio_read(files[fileno])
+                        trace.write(time.time(), names[fileno], value == '1')
+                    trace.flush()
+            finally:
+                for _, pin in self._pins:
+                    epoll.unregister(pin)
+
+
+def epoll_poll(epoll, timeout=-1):
+    """Return epoll events, [] if interrupted by signal(e.g. SIGUSR2)."""
+    try:
+        return epoll.poll(timeout)
+    except IOError, err:
+        if err.errno != errno.EINTR:
+            raise
+        return []
 
 
 def gpio_open(port, mode='r', register='', edge='none', active_low='0'):
@@ -222,20 +602,73 @@ def gpio_open(port, mode='r', register='', edge='none', active_low='0'):
 
 def main():
     """Run app mainloop."""
-    logging.basicConfig(
-        filename='/var/log/mpd-button.log',
-        format='[%(levelname)s] %(asctime)s [%(name)s] %(message)s',
-        datefmt='%Y/%m/%d %H:%M:%S',
-        level=logging.DEBUG)
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--record', metavar='PATH',
+        help='record gpio edge events to trace file instead of mpd control')
+    parser.add_argument(
+        '--encoder', metavar='PIN', type=int, nargs=2,
+        help='rotary encoder A/B gpio ports for volume control')
+    parser.add_argument(
+        '--control', metavar='ADDRESS', default=control.DEFAULT_ADDRESS,
+        help='control endpoint, unix socket path, @abstract or host:port'
+        ' for udp, none disables(default: %(default)s). abstract and udp'
+        ' endpoints have no access control')
+    parser.add_argument(
+        '--control-group', metavar='GROUP',
+        help='group allowed to write control socket path(default: owner'
+        ' only)')
+    parser.add_argument(
+        '--bind', metavar='GESTURE=ACTION', action='append', default=[],
+        help='bind gesture(click:PIN, double:PIN, long:PIN, chord:PIN+PIN)'
+        ' to action(%s), ACTION none unbinds' % ', '.join(App.ACTIONS))
+    for window in ['debounce', 'double', 'long', 'chord']:
+        parser.add_argument(
+            '--%s-sec' % window, type=float, metavar='SEC',
+            help='%s window(default: %.2f)' % (
+                window, getattr(gesture.Recognizer,
+                                '%s_SEC' % window.upper())))
+    args = parser.parse_args()
+    bindings = dict(App.BINDINGS)
+    for bind in args.bind:
+        key, _, action = bind.partition('=')
+        try:
+            key = gesture.parse(key)
+        except gesture.GestureError, err:
+            parser.error(str(err))
+        if action == 'none':
+            bindings.pop(key, None)
+        elif action in App.ACTIONS:
+            bindings[key] = action
+        else:
+            parser.error('unknown action: %s' % action)
+    windows = dict(('%s_sec' % window, getattr(args, '%s_sec' % window))
+                   for window in ['debounce', 'double', 'long', 'chord'])
+    ringlog.setup('/var/log/mpd-button.log')
     logger = logging.getLogger(__name__)
-    prev_album = gpio_open(22, edge='rising')
-    prev = gpio_open(10, edge='rising')
-    pause = gpio_open(9, edge='rising')
-    play = gpio_open(11, edge='rising')
-    next = gpio_open(23, edge='rising')
-    next_album = gpio_open(24, edge='rising')
-    sw = App(prev_album, prev, pause, play, next, next_album, logger)
-    sw.run()
+    # both edges to detect button release and keep button bounce in trace
+    prev_album = gpio_open(22, edge='both')
+    prev = gpio_open(10, edge='both')
+    pause = gpio_open(9, edge='both')
+    play = gpio_open(11, edge='both')
+    next = gpio_open(23, edge='both')
+    next_album = gpio_open(24, edge='both')
+    sw = App(prev_album, prev, pause, play, next, next_album, logger,
+             bindings, windows)
+    if args.encoder and not args.record:
+        volume = Volume(logger)
+        volume.start()
+        encoder = RotaryEncoder(gpio_open(args.encoder[0], edge='both'),
+                                gpio_open(args.encoder[1], edge='both'),
+                                volume.add, logger)
+        encoder.start()
+    if args.record:
+        sw.record(args.record)
+    elif args.control == 'none':
+        sw.run()
+    else:
+        sw.run(control.Server(args.control, sw.command, ['play', 'pause'],
+                              logger, args.control_group))
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,127 @@
+#!/usr/bin/python2
+
+"""Show per album or per track stats of mpd-lcd-i2c play history.
+
+    $ mpd-history
+    $ mpd-history --track --sort skips --top 50
+    $ mpd-history --since 2016-01-01 --causes
+"""
+
+
+import argparse
+import sys
+import time
+
+import history
+
+
+SORT_KEYS = ['plays', 'listened', 'skips', 'skip_rate', 'last']
+
+
+class Stats(object):
+
+    """Counters of one album or track."""
+
+    __slots__ = ['plays', 'finished', 'skips', 'listened', 'last']
+
+    def __init__(self):
+        """Initialize counters."""
+        self.plays = 0
+        self.finished = 0
+        self.skips = 0
+        self.listened = 0.0
+        self.last = 0
+
+    def add(self, play):
+        """Count play."""
+        self.plays += 1
+        if play.reason == history.FINISHED:
+            self.finished += 1
+        elif play.reason == history.SKIPPED:
+            self.skips += 1
+        self.listened += play.listened
+        self.last = max(self.last, play.start)
+
+    @property
+    def skip_rate(self):
+        """Return skipped play ratio."""
+        return float(self.skips) / self.plays if self.plays else 0.0
+
+
+def aggregate(plays, track=False, since=0):
+    """Return ({key: Stats}, {cause: skip count}) by one pass over plays.
+
+    key is album, (album, title) if track is True.
+    """
+    stats = {}
+    causes = {}
+    for play in plays:
+        if play.start < since:
+            continue
+        key = (play.album, play.title) if track else play.album
+        entry = stats.get(key)
+        if entry is None:
+            entry = stats[key] = Stats()
+        entry.add(play)
+        if play.reason == history.SKIPPED:
+            cause = play.cause or 'other client'
+            causes[cause] = causes.get(cause, 0) + 1
+    return stats, causes
+
+
+def hours(sec):
+    """Return h:mm string."""
+    return '%i:%02i' % (sec / 3600, sec % 3600 / 60)
+
+
+def main():
+    """Print stats table."""
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--path', default=history.DEFAULT_PATH,
+                        help='history file(default: %(default)s)')
+    parser.add_argument('--track', action='store_true',
+                        help='per track stats instead of per album')
+    parser.add_argument('--sort', choices=SORT_KEYS, default='plays',
+                        help='sort key(default: %(default)s)')
+    parser.add_argument('--top', type=int, default=20,
+                        help='rows to show, 0 shows all(default: %(default)s)')
+    parser.add_argument('--since', metavar='YYYY-MM-DD',
+                        help='count plays started at or after this date')
+    parser.add_argument('--causes', action='store_true',
+                        help='show skip count of each cause')
+    args = parser.parse_args()
+    since = 0
+    if args.since:
+        try:
+            since = time.mktime(time.strptime(args.since, '%Y-%m-%d'))
+        except ValueError, err:
+            parser.error(str(err))
+    try:
+        with open(args.path, 'rb') as f:
+            stats, causes = aggregate(history.read(f), args.track, since)
+    except (IOError, history.HistoryError), err:
+        sys.stderr.write('%s\n' % str(err))
+        sys.exit(1)
+
+    rows = sorted(stats.items(), key=lambda i: getattr(i[1], args.sort),
+                  reverse=True)
+    if args.top:
+        rows = rows[:args.top]
+    print '%6s %6s %5s %8s %10s  %s' % (
+        'plays', 'skips', 'skip%', 'listened', 'last', 'track' if args.track
+        else 'album')
+    for key, entry in rows:
+        name = ' / '.join(key) if args.track else key
+        print '%6i %6i %5.0f %8s %10s  %s' % (
+            entry.plays, entry.skips, entry.skip_rate * 100,
+            hours(entry.listened),
+            time.strftime('%Y-%m-%d', time.localtime(entry.last)), name)
+    if args.causes:
+        print
+        print '%6s  %s' % ('skips', 'cause')
+        for cause, count in sorted(causes.items(), key=lambda i: -i[1]):
+            print '%6i  %s' % (count, cause)
+
+if __name__ == '__main__':
+    main()
@@ -3,47 +3,83 @@
 """Show mpd status to i2c lcd display."""
 
 
-import copy
+import argparse
+import math
 import os
+import random
+import select
 import time
 import threading
-import subprocess
-import re
 import Queue
 import logging
-import traceback
 import signal
 import sys
 
 import smbus
 
+import clock
+import history
+import mpdclient
+import ringlog
+import romaji
+import sdnotify
+
 
 I2C_BUS = 1
 I2C_ADDRESS = 0x3c
-I2C_DDRAM_ADDRESS = (0x00, 0x20)
+# ddram address of each line by panel height
+I2C_DDRAM_ADDRESS = {2: (0x00, 0x20), 4: (0x00, 0x20, 0x40, 0x60)}
 I2C_DISPLAY_WIDTH = 16
+I2C_DISPLAY_HEIGHT = 2
+# other services show text by mpd client to client message:
+# "show<TAB>top line<TAB>bottom line" or "release"
+LCD_CHANNEL = 'mpd-lcd'
+# mpd-button sends "skip<TAB>cause" before it changes song
+HISTORY_CHANNEL = 'mpd-history'
 STARTUP_MESSAGE_SEC = 4
 
 
 class App(threading.Thread):
 
-    """Show MPD song/player information to I2C display."""
+    """Show MPD song/player information to I2C displays."""
 
     DISPLAY_SUSPEND_SEC = 10
     DISPLAY_FREEZE_SEC = 5
+    VOLUME_FREEZE_SEC = 2
+    MESSAGE_FREEZE_SEC = 15
     POLL_SEC = 0.2
-
-    def __init__(self, logger=None):
-        """Initialize mpd client and i2c display."""
+    PROGRESS_DOT_WIDTH = 5
+    # draw frame just after progressbar/time is changed
+    FRAME_MARGIN_SEC = 0.001
+    SPECTRUM_FPS = 15
+    SPECTRUM_FLOOR_DB = -60.0
+    # show progressbar if fifo is silent for this sec
+    SPECTRUM_SILENCE_SEC = 1.0
+    # play history is written with fsync at most this interval
+    HISTORY_FLUSH_SEC = 300
+
+    def __init__(self, logger=None, spectrum=None, recorder=None,
+                 panels=None):
+        """Initialize mpd client and i2c displays.
+
+        spectrum(pcmfifo.Spectrum) replaces status line progressbar with
+        spectrum analyzer while fifo has sound. recorder(history.Recorder)
+        records played songs. panels is list of Panel, default is one 16x2
+        display.
+        """
         self.logger = logger if logger else logging.getLogger(__name__)
         self.logger.info("start app")
         threading.Thread.__init__(self)
         self.setDaemon(True)
         # initialize display
-        self.display = I2CDisplay(I2C_BUS, I2C_ADDRESS,
-                                  I2C_DDRAM_ADDRESS, I2C_DISPLAY_WIDTH,
-                                  self.logger)
-        # self.display.set_brightness(0xFF)
+        if panels is None:
+            panels = [Panel(I2CDisplay(
+                I2C_BUS, I2C_ADDRESS, I2C_DDRAM_ADDRESS[I2C_DISPLAY_HEIGHT],
+                I2C_DISPLAY_WIDTH, self.logger))]
+        self.panels = panels
+        self.buses = BusGroup(panels)
+        # precomputed ascii text by mpd-romaji-index
+        self.romaji = romaji.Store()
 
         # initialize mpd client
         self.mpd = MPDStatus(self.logger)
@@ -55,104 +91,330 @@ class App(threading.Thread):
         self.mpd.bind(self.mpd.EVENT_CHANGE, self.event_update_song)
         self.mpd.bind(self.mpd.EVENT_SERVER_DOWN, self.event_show_error)
         self.mpd.bind(self.mpd.EVENT_SERVER_HANGUP, self.event_show_error)
-
-        self.mpd.start()
+        self.mpd.bind(self.mpd.EVENT_SERVER_WAKEUP, self.event_update_song)
+        self.mpd.bind(self.mpd.EVENT_VOLUME, self.event_show_volume)
+        self.mpd.bind(self.mpd.EVENT_UPDATE, self.event_schedule_frame)
+        self.mpd.bind(self.mpd.EVENT_NEXT, self.event_prerender_next)
+        self.mpd.bind(self.mpd.EVENT_MESSAGE, self.event_show_message)
+        self.recorder = recorder
+        self.tracker = None
+        self._history_flush_time = clock.monotonic()
+        if recorder:
+            self.tracker = history.Tracker(recorder)
+            for event in [self.mpd.EVENT_CHANGE, self.mpd.EVENT_PLAY,
+                          self.mpd.EVENT_PAUSE, self.mpd.EVENT_STOP,
+                          self.mpd.EVENT_UPDATE, self.mpd.EVENT_MESSAGE]:
+                self.mpd.bind(event, self.event_track_history)
 
         # poll event functions(used by self.run())
-        self._timer = [self.timer_update_time,
-                       self.timer_display_suspend,
+        self._timer = [self.timer_display_suspend,
                        self.timer_scroll]
+        # systemd restarts app if mainloop stops pinging watchdog
+        self._watchdog_sec = sdnotify.watchdog_sec()
+        self._watchdog_time = 0.0
+        if self._watchdog_sec:
+            self._timer.append(self.timer_watchdog)
+        if recorder:
+            self._timer.append(self.timer_flush_history)
+        # next timer_update_time kick time(used by self.run())
+        self._next_frame = None
+        self._frame_lock = threading.Lock()
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        self.spectrum = spectrum
+        self._spectrum_bars = []
+        self._spectrum_time = -self.SPECTRUM_SILENCE_SEC
+        # (song id, Layout) of next song
+        self._prerendered = None
 
         self._queue = Queue.Queue()
         self._display_suspend_time = -1  # < 0 means disable
-        self._line2_hold_time = -1  # < 0 means disable
         self._queue.put(self.startup_message)
         signal.signal(signal.SIGTERM, self.exit)
         signal.signal(signal.SIGINT, self.exit)
+        # events use app state, start after it is ready
+        self.mpd.start()
 
     def exit(self, signum, frame):
         """display of when exit app."""
         self.logger.info("stop app")
-        self.display.off()
+        if self.recorder:
+            try:
+                self.recorder.flush()
+            except (IOError, OSError, history.HistoryError), err:
+                self.logger.warn("history write failed: %s" % str(err))
+        for panel in self.panels:
+            try:
+                panel.display.off()
+            except I2CError:
+                pass
         sys.exit(0)
 
     def startup_message(self):
         """Show startup message."""
-        self.display.write('RuneAudio'.upper().center(self.display.width),
-                           line=0)
-        self.display.set_char(0, [0b11111]*8)
-        self.display.write_raw([0]*self.display.width, line=1)
+        def draw(panel):
+            display = panel.display
+            display.write('RuneAudio'.upper().center(display.width), line=0)
+            display.set_char(0, [0b11111]*8)
+            display.write_raw([0]*display.width, line=panel.status_line)
+        self.buses.run(draw)
         time.sleep(STARTUP_MESSAGE_SEC)
 
     def timer_update_time(self):
-        """Update bottom line playing time.
+        """Update status line playing time.
 
         * check status is playing
-        * check _line2_hold_time is expired
+        * skip panels whose status line hold time is not expired
+        * schedule next call when progressbar or time will be changed
         """
         if not self.mpd.player()['status'] == 'playing':
             return
-        if self._line2_hold_time > time.time():
+        now = clock.monotonic()
+        panels = [i for i in self.panels if i.hold_time <= now]
+        held = [i.hold_time - now for i in self.panels if i.hold_time > now]
+        if not panels:
+            self.schedule_frame(min(held))
+            return
+        if self.spectrum is not None and self.update_spectrum(now, panels):
+            self.schedule_frame(1.0 / self.SPECTRUM_FPS)
             return
-        if not self.display.is_on():
-            self.display.on()
         song = self.mpd.song()
-        if 'time_elapsed' not in song:
+        if 'time_elapsed' not in song or not song.get('length'):
             return
-        now = song['time_elapsed']
-        # left_data = self.make_progressbar_bordered(now, song['length'], 10)
-        self.display.write_raw(
-            list(self.make_progressbar_full(now, song['length'])), 1)
-        # bottom = ' %02i:%02i' % (now / 60, now % 60)
-        # right_data = map(ord, list(bottom))
-        # self.display.write_raw(left_data + right_data, line=1)
+        elapsed = song['time_elapsed']
+        # rendered once for each panel width
+        bars = dict((width, self.make_progressbar_full(
+            elapsed, song['length'], width))
+            for width in set(i.display.width for i in panels))
+
+        def draw(panel):
+            if not panel.display.is_on():
+                panel.display.on()
+            chars, codes = bars[panel.display.width]
+            for pos, data in chars:
+                panel.display.set_char(pos, data)
+            panel.display.write_raw(codes, panel.status_line)
+        self.buses.run(draw, panels)
+        rate, rate_until = self.mpd.elapsed_rate()
+        secs = [self.next_frame_sec(elapsed, song['length'], rate, width)
+                for width in bars]
+        # redraw held panels when their hold time is expired
+        secs = [i for i in secs if i is not None] + held
+        if rate_until is not None:
+            secs.append(max(0.0, rate_until - clock.monotonic()))
+        self.schedule_frame(min(secs) if secs else None)
+
+    def update_spectrum(self, now, panels):
+        """Draw spectrum bars to status line, return False if silent.
+
+        bars fall 1 row per frame and only changed bars are written, bands
+        are stretched to each panel width.
+        """
+        if not self.spectrum.reader.read():
+            return now - self._spectrum_time < self.SPECTRUM_SILENCE_SEC
+        heights = self.spectrum.heights(8, self.SPECTRUM_FLOOR_DB)
+        if max(heights):
+            self._spectrum_time = now
+        elif now - self._spectrum_time >= self.SPECTRUM_SILENCE_SEC:
+            return False
+        bars = [max(new, old - 1) for new, old in zip(
+            heights, self._spectrum_bars or [0] * len(heights))]
+        self._spectrum_bars = bars
+        cells = dict((width, [bars[i * len(bars) / width] - 1
+                              if bars[i * len(bars) / width] else ord(' ')
+                              for i in xrange(width)])
+                     for width in set(i.display.width for i in panels))
+
+        def draw(panel):
+            if not panel.display.is_on():
+                panel.display.on()
+            for i in xrange(8):
+                panel.display.set_char(
+                    i, [0] * (7 - i) + [0b11111] * (i + 1))
+            panel.display.write_changed(cells[panel.display.width],
+                                        line=panel.status_line)
+        self.buses.run(draw, panels)
+        return True
+
+    def next_frame_sec(self, elapsed, length, rate, width):
+        """Return sec until progressbar moves 1 dot or time digit changes.
+
+        None means progressbar does not move.
+        """
+        if rate == 0 or not 0 <= elapsed < length:
+            return None
+        dots = width * self.PROGRESS_DOT_WIDTH
+        dot = dots * elapsed / length
+        if rate > 0:
+            target = min((math.floor(dot) + 1) * length / dots,
+                         math.floor(elapsed) + 1)
+        else:
+            target = max(math.floor(dot) * length / dots,
+                         math.floor(elapsed))
+        return max(0.0, (target - elapsed) / rate) + self.FRAME_MARGIN_SEC
+
+    def schedule_frame(self, sec=0.0):
+        """Kick timer_update_time after given sec, None cancels."""
+        with self._frame_lock:
+            self._next_frame = (None if sec is None else
+                                clock.monotonic() + sec)
+        os.write(self._wakeup_w, '\0')
+
+    def event_schedule_frame(self, event):
+        """Redraw progressbar for new mpd status."""
+        self.schedule_frame()
 
     def timer_display_suspend(self):
         """Suspend display if expire."""
         if self._display_suspend_time < 0:
             return
-        if self._display_suspend_time < time.time() and self.display.is_on():
-            self.display.off()
+        panels = [i for i in self.panels if i.display.is_on()]
+        if self._display_suspend_time < clock.monotonic() and panels:
+            self.buses.run(lambda panel: panel.display.off(), panels)
+
+    def timer_watchdog(self):
+        """Ping systemd watchdog from mainloop."""
+        now = clock.monotonic()
+        if now - self._watchdog_time >= self._watchdog_sec / 4:
+            sdnotify.notify('WATCHDOG=1')
+            self._watchdog_time = now
+
+    def timer_flush_history(self):
+        """Write play history if flush interval is passed."""
+        now = clock.monotonic()
+        if now - self._history_flush_time < self.HISTORY_FLUSH_SEC:
+            return
+        self._history_flush_time = now
+        try:
+            self.recorder.flush()
+        except (IOError, OSError, history.HistoryError), err:
+            self.logger.warn("history write failed: %s" % str(err))
+
+    def event_track_history(self, event):
+        """Pass mpd events to play history tracker."""
+        now = clock.monotonic()
+        playing = self.mpd.player()['status'] == 'playing'
+        if event == self.mpd.EVENT_MESSAGE:
+            for message in self.mpd.messages(HISTORY_CHANNEL):
+                command, _, cause = message.partition('\t')
+                if command == 'skip':
+                    self.tracker.cause(cause, now)
+            return
+        if event == self.mpd.EVENT_STOP:
+            full = self.tracker.end(now, stopped=True)
+        elif event == self.mpd.EVENT_CHANGE or (
+                event == self.mpd.EVENT_PLAY and
+                not self.tracker.is_playing()):
+            full = self.tracker.end(now)
+            self.tracker.start(self.mpd.song(), playing, now)
+        else:
+            full = False
+            self.tracker.progress(
+                self.mpd.song().get('time_elapsed', 0.0), playing, now)
+        if full:
+            self._history_flush_time = -self.HISTORY_FLUSH_SEC
+            self._queue.put(self.timer_flush_history)
 
     def timer_scroll(self):
         """Scroll line1 text."""
-        if self.display.is_on():
-            self.display.shift(0)
+        panels = [i for i in self.panels if i.display.is_on()]
+        if panels:
+            self.buses.run(lambda panel: panel.display.shift(0), panels)
 
     def event_update_song(self, event=''):
         """Update playing song string.
 
-        * set track/title/album to top line.
-        * set artist to bottom line.
+        title frame is prerendered if mpd moved to prefetched next song.
         """
         def update_title():
-            if not self.display.is_on():
-                self.display.on()
-            top = '{title} / {album} #{track:0>2}'.format(**self.mpd.song())
-            self.display.write(
-                kakasi(top).ljust(self.display.width).upper(), line=0)
-            bottom = '{artist}'.format(**self.mpd.song())
-            self.display.write(
-                kakasi(bottom).center(self.display.width).upper(), line=1)
-            # freeze line2
-            self._line2_hold_time = time.time() + self.DISPLAY_FREEZE_SEC
+            song = self.mpd.song()
+            prerendered = self._prerendered
+            if prerendered and prerendered[0] == song.get('id'):
+                layout = prerendered[1]
+            else:
+                layout = self.render_title(song)
+            hold_time = clock.monotonic() + self.DISPLAY_FREEZE_SEC
+
+            def draw(panel):
+                if not panel.display.is_on():
+                    panel.display.on()
+                panel.display.write_frame(layout.frame(panel))
+                if not panel.has_status_line():
+                    # freeze status line showing last field
+                    panel.hold_time = hold_time
+            self.buses.run(draw)
             # extend display suspend time
             if self._display_suspend_time > 0:
-                self._display_suspend_time = (time.time() +
+                self._display_suspend_time = (clock.monotonic() +
                                               self.DISPLAY_SUSPEND_SEC)
         self._queue.put(update_title)
 
+    def event_prerender_next(self, event):
+        """Render next song title frame before mpd switches to it."""
+        def prerender():
+            song = self.mpd.next_song()
+            if not song:
+                self._prerendered = None
+                return
+            self._prerendered = (song['id'], self.render_title(song))
+        self._queue.put(prerender)
+
+    def render_title(self, song):
+        """Return Layout of song for all panels."""
+        return Layout(song, self.transliterate, self.panels)
+
+    def transliterate(self, string):
+        """Return ascii text from precomputed store or kakasi."""
+        if romaji.is_ascii(string):
+            return string
+        ret = self.romaji.get(string)
+        if ret is None:
+            ret = romaji.kakasi(string)
+        return ret
+
     def event_suspend_display(self, event):
         """Suspend display if paused/stopped."""
         if event not in [self.mpd.EVENT_PAUSE, self.mpd.EVENT_STOP]:
             return
 
         def show_message():
-            self.display.write(
-                event.center(self.display.width).upper(), line=1)
-            self._display_suspend_time = time.time() + self.DISPLAY_SUSPEND_SEC
+            self.write_status(event)
+            self._display_suspend_time = (clock.monotonic() +
+                                          self.DISPLAY_SUSPEND_SEC)
         self._queue.put(show_message)
 
+    def event_show_volume(self, event):
+        """Show new volume to bottom line."""
+        def show_volume():
+            volume = 'volume %s%%' % self.mpd.player().get('volume', '')
+            self.write_status(volume, True, self.VOLUME_FREEZE_SEC)
+        self._queue.put(show_volume)
+
+    def event_show_message(self, event):
+        """Show text sent to LCD_CHANNEL until released."""
+        def show_message(message):
+            if message == 'release':
+                for panel in self.panels:
+                    panel.hold_time = -1
+                self.event_update_song()
+                return
+            command, _, text = message.partition('\t')
+            if command != 'show':
+                self.logger.warn("unknown message: %r" % message)
+                return
+            top, _, bottom = text.partition('\t')
+            hold_time = clock.monotonic() + self.MESSAGE_FREEZE_SEC
+
+            def draw(panel):
+                display = panel.display
+                if not display.is_on():
+                    display.on()
+                display.write(top.ljust(display.width).upper(), 0)
+                display.write(bottom.ljust(display.width).upper(), 1)
+                panel.hold_time = hold_time
+            self.buses.run(draw)
+        for message in self.mpd.messages(LCD_CHANNEL):
+            self._queue.put(lambda message=message: show_message(message))
+
     def event_cancel_suspend_display(self, event):
         """Clear display suspend time."""
         self._display_suspend_time = -1
@@ -162,33 +424,75 @@ class App(threading.Thread):
         self.event_cancel_suspend_display(event)
 
         def show_message():
-            self.display.write(
-                event.center(self.display.width).upper(), line=1)
+            self.write_status(event)
         self._queue.put(show_message)
 
+    def write_status(self, text, turn_on=False, hold_sec=None):
+        """Write centered text to status line of all panels."""
+        hold_time = None if hold_sec is None else (
+            clock.monotonic() + hold_sec)
+
+        def draw(panel):
+            display = panel.display
+            if turn_on and not display.is_on():
+                display.on()
+            display.write(text.center(display.width).upper(),
+                          line=panel.status_line)
+            if hold_time is not None:
+                panel.hold_time = hold_time
+        self.buses.run(draw)
+
     def run(self):
-        """Kick timer functions."""
+        """Kick timer functions and scheduled timer_update_time."""
+        next_poll = clock.monotonic()
         while True:
-            time.sleep(self.POLL_SEC)
-            for func in self._timer:
-                self._queue.put(func)
+            now = clock.monotonic()
+            if now >= next_poll:
+                for func in self._timer:
+                    self._queue.put(func)
+                next_poll = now + self.POLL_SEC
+            with self._frame_lock:
+                next_frame = self._next_frame
+                if next_frame is not None and now >= next_frame:
+                    self._next_frame = next_frame = None
+                    self._queue.put(self.timer_update_time)
+            deadline = (next_poll if next_frame is None else
+                        min(next_poll, next_frame))
+            readable, _, _ = select.select(
+                [self._wakeup_r], [], [],
+                max(0.0, deadline - clock.monotonic()))
+            if readable:
+                os.read(self._wakeup_r, 4096)
 
     def main(self):
         """App mainloop."""
         self.start()
-        self.display.on()
+        try:
+            self.buses.run(lambda panel: panel.display.on())
+        except I2CError:
+            # turned on when display recovers
+            pass
+        sdnotify.notify('READY=1')
         while True:
             try:
                 func = self._queue.get(block=True)
                 func()
+            except I2CError, err:
+                # skip this frame, display recovers at next write
+                self.logger.debug("frame skipped: %s" % str(err))
+                self.schedule_frame(I2CDisplay.RECOVER_MIN_SEC)
             except Exception, err:
+                import traceback
                 self.logger.critical(traceback.format_exc())
                 self.logger.critical(
                     "unexpect exception in App mainloop: %s" % str(err))
                 time.sleep(1)
 
-    def make_progressbar_full(self, time_elapsed, length):
-        """Make progressbar and time elapsed num font in display cgram."""
+    def make_progressbar_full(self, time_elapsed, length, width):
+        """Return (cgram chars, codes) of progressbar and elapsed time.
+
+        chars is list of (cgram pos, font data).
+        """
         font_width = 5
         font_height = 8
 
@@ -308,8 +612,8 @@ class App(threading.Thread):
                 else:
                     yield 0b00000
 
-        screen_width = self.display.width * font_width
-        elapsed_screen_width = screen_width * time_elapsed / length
+        screen_width = width * font_width
+        elapsed_screen_width = int(screen_width * time_elapsed / length)
         progress_char_pos = elapsed_screen_width / font_width
 
         fill_char = 0
@@ -325,61 +629,43 @@ class App(threading.Thread):
         empty = list(bar(0))
         progress = list(bar(elapsed_screen_width % font_width))
 
-        self.display.set_char(fill_char, fill)
-        self.display.set_char(empty_char, empty)
-        self.display.set_char(progress_char, progress)
+        chars = [(fill_char, fill), (empty_char, empty),
+                 (progress_char, progress)]
         elapsed_str = '%02i:%02i' % (time_elapsed / 60, time_elapsed % 60)
-        self.display.set_char(
-            elapsed_minute_10_char,
-            nums[elapsed_str[-5]](
-                fill if (progress_char_pos > self.display.width - 5) else
-                (progress if (progress_char_pos == self.display.width - 5) else
-                 empty)))
-        self.display.set_char(
-            elapsed_minute_1_char,
-            nums[elapsed_str[-4]](
-                fill if (progress_char_pos > self.display.width - 4) else
-                (progress if (progress_char_pos == self.display.width - 4) else
-                 empty)))
-        self.display.set_char(
-            elapsed_colon_char,
-            nums[elapsed_str[-3]](
-                fill if (progress_char_pos > self.display.width - 3) else
-                (progress if (progress_char_pos == self.display.width - 3) else
-                 empty)))
-        self.display.set_char(
-            elapsed_second_10_char,
-            nums[elapsed_str[-2]](
-                fill if (progress_char_pos > self.display.width - 2) else
-                (progress if (progress_char_pos == self.display.width - 2) else
-                 empty)))
-        self.display.set_char(
-            elapsed_second_1_char,
-            nums[elapsed_str[-1]](
-                fill if (progress_char_pos > self.display.width - 1) else
-                (progress if (progress_char_pos == self.display.width - 1) else
-                 empty)))
-        for i in xrange(self.display.width - 5):
+        for i, char in enumerate([elapsed_minute_10_char,
+                                  elapsed_minute_1_char,
+                                  elapsed_colon_char,
+                                  elapsed_second_10_char,
+                                  elapsed_second_1_char]):
+            # num font over progressbar cell of its position
+            pos = width - 5 + i
+            chars.append((char, list(nums[elapsed_str[i - 5]](
+                fill if progress_char_pos > pos else
+                (progress if progress_char_pos == pos else empty)))))
+        codes = []
+        for i in xrange(width - 5):
             if i < progress_char_pos:
-                yield fill_char
+                codes.append(fill_char)
             elif i == progress_char_pos:
-                yield progress_char
+                codes.append(progress_char)
             else:
-                yield empty_char
-
-        yield elapsed_minute_10_char
-        yield elapsed_minute_1_char
-        yield elapsed_colon_char
-        yield elapsed_second_10_char
-        yield elapsed_second_1_char
+                codes.append(empty_char)
+        codes.extend([elapsed_minute_10_char, elapsed_minute_1_char,
+                      elapsed_colon_char, elapsed_second_10_char,
+                      elapsed_second_1_char])
+        return chars, codes
 
     def make_progressbar_simple(self, time_elapsed, length, width):
-        """Make progressbar char in display cgram."""
+        """Return (cgram chars, codes) of progressbar."""
+        chars = []
         char_fill = 0
         char_prog = 1
         char_empty = 2
         char_dot_width = 5
 
+        def set_char(pos, data):
+            chars.append((pos, list(data)))
+
         def bar(progress):
             """Make boxed progress bar."""
             depth = 0b11111 << (5 - progress) & 0b11111
@@ -390,25 +676,25 @@ class App(threading.Thread):
                     yield 0b00000
 
         dot_length = char_dot_width * width
-        dot_elapsed = dot_length * time_elapsed / length
+        dot_elapsed = int(dot_length * time_elapsed / length)
 
         change_pos = dot_elapsed / char_dot_width
-        self.display.set_char(
-            char_fill, bar(char_dot_width))
-        self.display.set_char(
-            char_prog, bar(dot_elapsed % char_dot_width))
-        self.display.set_char(
-            char_empty, bar(0))
+        set_char(char_fill, bar(char_dot_width))
+        set_char(char_prog, bar(dot_elapsed % char_dot_width))
+        set_char(char_empty, bar(0))
+        codes = []
         for i in xrange(width):
             if i < change_pos:
-                yield char_fill
+                codes.append(char_fill)
             elif i == change_pos:
-                yield char_prog
+                codes.append(char_prog)
             else:
-                yield char_empty
+                codes.append(char_empty)
+        return chars, codes
 
     def make_progressbar_bordered(self, time_elapsed, length, width):
-        """Make progressbar char in display cgram."""
+        """Return (cgram chars, codes) of progressbar."""
+        chars = []
         char_left = 0
         char_centre = 1
         char_right = 2
@@ -455,6 +741,9 @@ class App(threading.Thread):
                 else:
                     yield 0b00000
 
+        def set_char(pos, data):
+            chars.append((pos, list(data)))
+
         def bar(progress):
             """Make boxed progress bar."""
             depth = 0b11111 << (5 - progress) & 0b11111
@@ -463,13 +752,14 @@ class App(threading.Thread):
 
         dot_length = (
             left_dot_width + right_dot_width + centre_dot_width * (width-2))
-        dot_elapsed = dot_length * time_elapsed / length
+        dot_elapsed = int(dot_length * time_elapsed / length)
         if dot_elapsed <= left_dot_width:
-            self.display.set_char(
+            set_char(
                 0, left_box(bar(char_dot_width-left_dot_width+dot_elapsed)))
-            self.display.set_char(1, centre_box(bar(0)))
-            self.display.set_char(2, right_box(bar(0)))
-            return [char_left] + [char_centre] * (width-2) + [char_right]
+            set_char(1, centre_box(bar(0)))
+            set_char(2, right_box(bar(0)))
+            return chars, ([char_left] + [char_centre] * (width-2) +
+                           [char_right])
         elif dot_elapsed <= centre_dot_width * (width-2) + left_dot_width:
             centre_total_width = dot_elapsed - left_dot_width
             change_pos = centre_total_width / char_dot_width
@@ -481,27 +771,28 @@ class App(threading.Thread):
                     centre_str.append(char_centre)
                 else:
                     centre_str.append(char_centre_empty)
-            self.display.set_char(
+            set_char(
                 char_left, left_box(bar(char_dot_width)))
-            self.display.set_char(
+            set_char(
                 char_centre,
                 centre_box(bar(centre_total_width % char_dot_width)))
-            self.display.set_char(
+            set_char(
                 char_right, right_box(bar(0)))
-            self.display.set_char(
+            set_char(
                 char_centre_fill, centre_box(bar(char_dot_width)))
-            self.display.set_char(
+            set_char(
                 char_centre_empty, centre_box(bar(0)))
-            return [char_left] + centre_str + [char_right]
+            return chars, [char_left] + centre_str + [char_right]
         else:
-            self.display.set_char(
+            set_char(
                 char_left, left_box(bar(char_dot_width)))
-            self.display.set_char(
+            set_char(
                 char_centre, centre_box(bar(char_dot_width)))
-            self.display.set_char(
+            set_char(
                 char_right,
                 right_box(bar(right_dot_width - dot_length + dot_elapsed)))
-            return [char_left] + [char_centre] * (width-2) + [char_right]
+            return chars, ([char_left] + [char_centre] * (width-2) +
+                           [char_right])
 
 
 class MPDStatus(threading.Thread):
@@ -515,13 +806,36 @@ class MPDStatus(threading.Thread):
     EVENT_SERVER_DOWN = 'server down'
     EVENT_SERVER_WAKEUP = 'server wakeup'
     EVENT_SERVER_HANGUP = 'server hang-up'
+    EVENT_VOLUME = 'volume'
+    EVENT_UPDATE = 'updated'
+    EVENT_NEXT = 'next changed'
+    EVENT_MESSAGE = 'message'
+
+    STATES = {'play': 'playing', 'pause': 'paused', 'stop': 'stopped'}
+    SETTINGS = ['volume', 'repeat', 'random', 'single', 'consume']
+
+    # follow seek speed for this sec after elapsed time jumped
+    SEEK_PREDICT_SEC = 0.5
+    # mpd reconnect interval range while mpd is down
+    BACKOFF_MIN_SEC = 0.01
+    BACKOFF_MAX_SEC = 0.5
+    # retry interval limit while mpd rejects command(e.g. permission)
+    REJECTED_BACKOFF_MAX_SEC = 10.0
 
     def __init__(self, logger=None):
         """Init status cache data."""
         self.logger = logger if logger else logging.getLogger(__name__)
-        self._updatetime = time.time()
+        self.client = mpdclient.MPDClient(logger=self.logger,
+                                          channels=[LCD_CHANNEL,
+                                                    HISTORY_CHANNEL])
+        self._updatetime = clock.monotonic()
+        self._rate = 1.0
+        self._rate_until = 0.0
         self.fetch_data = ['artist', 'title', 'track', 'album']
         self._song = {}
+        self._next_song = {}
+        # (nextsongid, playlist version) of _next_song
+        self._next_key = None
         self._player = {}
         self._player['status'] = 'playing'
         self.player_settings = {}
@@ -530,7 +844,10 @@ class MPDStatus(threading.Thread):
         self.current_time = 0
         self.time = 0
         self._callbacks = {}
+        self._messages = []
         self._mpd_isalive = False
+        self._mpd_error = None
+        self._backoff = self.BACKOFF_MIN_SEC
         threading.Thread.__init__(self)
         self.setDaemon(True)
 
@@ -549,99 +866,295 @@ class MPDStatus(threading.Thread):
         while True:
             try:
                 events = []
-                fetch_data_format = '\001'.join(
-                    ['%%%s%%' % i for i in self.fetch_data])
-                out = subprocess.check_output(
-                    'mpc -f "%s"' % fetch_data_format, shell=True)
-                self._updatetime = time.time()
-                outlines = out.splitlines()
-                if len(outlines) == 3 or len(outlines) == 4:
-                    if len(outlines) == 4:
-                        recv_data_format, status, _, settings = outlines
+                song = dict(self.client.command('currentsong'))
+                status = self.client.status()
+                updatetime = clock.monotonic()
+                self._song.update(self._tags(song))
+
+                new_status = self.STATES.get(status.get('state'), 'stopped')
+                if 'song' in status and new_status != 'stopped':
+                    new_playlist_pos = int(status['song']) + 1
+                    new_time_elapsed = float(status.get('elapsed', 0))
+                    if self.playlist_pos != new_playlist_pos:
+                        self.playlist_pos = new_playlist_pos
+                        events.append(self.EVENT_CHANGE)
+                        self._rate_until = 0.0
+                    elif (new_status == 'playing' and
+                          self._player['status'] == 'playing' and
+                          'time_elapsed' in self._song):
+                        self._predict_rate(new_time_elapsed, updatetime)
+                    self._song['time_elapsed'] = new_time_elapsed
+                    if 'duration' in status:
+                        self._song['length'] = float(status['duration'])
                     else:
-                        recv_data_format, status, settings = outlines
-                    recv_data = recv_data_format.split('\001')
-                    for index, key in enumerate(self.fetch_data):
-                        self._song[key] = recv_data[index].strip()
-
-                    # [playing] #341/4463   3:48/4:07 (92%)
-                    match = re.search(
-                        '\[([^\]]+)\] +\#(\d+)/(\d+) +(\d+):(\d+)/(\d+):(\d+)',
-                        status)
-                    if match:
-                        new_playlist_pos = int(match.group(2))
-                        if self.playlist_pos != new_playlist_pos:
-                            self.playlist_pos = new_playlist_pos
-                            events.append(self.EVENT_CHANGE)
-
-                        self.playlist_size = int(match.group(3))
-                        self._song['time_elapsed'] = (
-                            int(match.group(4))*60 + int(match.group(5)))
-                        self._song['length'] = (
-                            int(match.group(6))*60 + int(match.group(7)))
-
-                        new_status = match.group(1)
-                        if self._player['status'] != new_status:
-                            self._player['status'] = new_status
-                            if new_status == 'playing':
-                                events.append(self.EVENT_PLAY)
-                            if new_status == 'paused':
-                                events.append(self.EVENT_PAUSE)
-                else:
-                    if self._player['status'] != 'stopped':
-                        self._player['status'] = 'stopped'
+                        self._song['length'] = float(
+                            status.get('time', '0:0').split(':')[1])
+
+                if self._player['status'] != new_status:
+                    self._player['status'] = new_status
+                    if new_status == 'playing':
+                        events.append(self.EVENT_PLAY)
+                    if new_status == 'paused':
+                        events.append(self.EVENT_PAUSE)
+                    if new_status == 'stopped':
                         events.append(self.EVENT_STOP)
-                    settings = outlines[-1]
+                self.playlist_size = int(status.get('playlistlength', 0))
+                next_key = (status.get('nextsongid'), status.get('playlist'))
+                if next_key != self._next_key:
+                    self._next_key = next_key
+                    self._next_song = self._fetch_song(next_key[0])
+                    events.append(self.EVENT_NEXT)
+                self._updatetime = updatetime
+                if ('volume' in self._player and
+                        status.get('volume') != self._player['volume']):
+                    events.append(self.EVENT_VOLUME)
                 self._player.update(
-                    [i.strip().split(':') for i in settings.split('   ')
-                        if i.strip()])
+                    (key, status[key]) for key in self.SETTINGS
+                    if key in status)
+                events.append(self.EVENT_UPDATE)
                 for event in events:
                     self.call(event)
+                # backoff is reset by full cycle, not by ping
+                self._backoff = self.BACKOFF_MIN_SEC
                 if not self._mpd_isalive:
                     self._mpd_isalive = True
+                    self._mpd_error = None
                     self.logger.info("mpd is alive")
                     self.call(self.EVENT_SERVER_WAKEUP)
-                subprocess.check_output('mpc idle', shell=True)
-            except subprocess.CalledProcessError:
-                if self._mpd_isalive:
-                    out = subprocess.check_output('ps aux', shell=True)
-                    if "/usr/bin/mpd" not in out:
-                        self._mpd_isalive = False
-                        self.logger.warn("mpd is down")
-                        self.call(self.EVENT_SERVER_DOWN)
-                    else:
-                        self.logger.warn("mpc command failed")
-                        self.call(self.EVENT_SERVER_HANGUP)
-                time.sleep(1)
+                changed = self.client.idle('player', 'playlist', 'options',
+                                           'mixer', 'message')
+                if 'message' in changed:
+                    self._messages.extend(self.client.messages())
+                    self.call(self.EVENT_MESSAGE)
+            except mpdclient.MPDError, err:
+                self._mpd_isalive = False
+                self._report_error(err)
+                if err.reason == mpdclient.PROTOCOL_ERROR:
+                    # mpd is up but rejects command, reconnect does not help
+                    self._sleep_backoff(self.REJECTED_BACKOFF_MAX_SEC)
+                    continue
+                self.client.close()
+                self._next_key = None
+                self.wait_alive()
             except Exception, err:
+                import traceback
                 self.logger.critical(traceback.format_exc())
                 self.logger.critical(
                     "unexpect exception in mpd client thread: %s" % str(err))
                 time.sleep(1)
 
+    def _tags(self, song):
+        """Return fetch_data and id of mpd song response."""
+        ret = dict((key, song.get(key.capitalize(), '').strip())
+                   for key in self.fetch_data)
+        ret['id'] = song.get('Id', '')
+        ret['file'] = song.get('file', '')
+        return ret
+
+    def _fetch_song(self, songid):
+        """Return song data of queue entry, empty dict if not found."""
+        if songid is None:
+            return {}
+        try:
+            songs = self.client.songs('playlistid', songid)
+        except mpdclient.MPDError, err:
+            # removed after status command
+            if err.reason != mpdclient.PROTOCOL_ERROR:
+                raise
+            return {}
+        return self._tags(songs[0]) if songs else {}
+
+    def _report_error(self, err):
+        """Call server down/hang-up event if mpd error state is changed."""
+        if err.reason == self._mpd_error:
+            return
+        self._mpd_error = err.reason
+        if err.reason == mpdclient.REFUSED:
+            self.logger.warn("mpd is down: %s" % str(err))
+            self.call(self.EVENT_SERVER_DOWN)
+        else:
+            self.logger.warn("mpd command failed: %s" % str(err))
+            self.call(self.EVENT_SERVER_HANGUP)
+
+    def _sleep_backoff(self, max_sec):
+        """Sleep with full jitter and double backoff up to max_sec."""
+        time.sleep(random.uniform(0, self._backoff))
+        self._backoff = min(self._backoff * 2, max_sec)
+
+    def wait_alive(self):
+        """Wait until mpd responds to ping.
+
+        Retries connect/ping with exponential backoff and full jitter, no
+        process is spawned while mpd is down.
+        """
+        while True:
+            self._sleep_backoff(self.BACKOFF_MAX_SEC)
+            try:
+                self.client.command('ping')
+                return
+            except mpdclient.MPDError, err:
+                self._report_error(err)
+                if err.reason == mpdclient.PROTOCOL_ERROR:
+                    # mpd is up, run() backs off on rejected commands
+                    return
+                self.client.close()
+
+    def _predict_rate(self, time_elapsed, updatetime):
+        """Follow seek speed if elapsed time jumped since last update.
+
+        Held prev/next button seeks current song step by step, so keep
+        progress moving at observed speed until next mpd update is expected.
+        """
+        interval = updatetime - self._updatetime
+        moved = time_elapsed - self._song['time_elapsed']
+        if abs(moved - interval) > 1 and 0 < interval < self.SEEK_PREDICT_SEC:
+            self._rate = moved / interval
+            self._rate_until = updatetime + self.SEEK_PREDICT_SEC
+        else:
+            self._rate_until = 0.0
+
+    def _elapsed(self, now):
+        """Return predicted elapsed time at given monotonic time."""
+        interval = now - self._updatetime
+        if now < self._rate_until:
+            interval *= self._rate
+        elapsed = self._song['time_elapsed'] + interval
+        if self._song.get('length'):
+            elapsed = min(elapsed, self._song['length'])
+        return max(elapsed, 0.0)
+
     def song(self):
         """Return song data."""
-        ret = copy.copy(self._song)
-        if self._player['status'] == 'playing':
-            ret['time_elapsed'] += int(time.time() - self._updatetime)
+        ret = dict(self._song)
+        if self._player['status'] == 'playing' and 'time_elapsed' in ret:
+            ret['time_elapsed'] = self._elapsed(clock.monotonic())
         return ret
 
+    def messages(self, channel):
+        """Return and clear received messages of channel."""
+        ret = [i[1] for i in self._messages if i[0] == channel]
+        self._messages = [i for i in self._messages if i[0] != channel]
+        return ret
+
+    def next_song(self):
+        """Return prefetched song data of next queue entry."""
+        return dict(self._next_song)
+
+    def elapsed_rate(self):
+        """Return elapsed time speed and monotonic time the speed ends.
+
+        speed is 0 if not playing, end time is None if speed is not
+        predicted seek speed.
+        """
+        if self._player['status'] != 'playing':
+            return 0.0, None
+        rate_until = self._rate_until
+        if clock.monotonic() < rate_until:
+            return self._rate, rate_until
+        return 1.0, None
+
     def player(self):
         """Return player data."""
-        return copy.copy(self._player)
+        return dict(self._player)
+
+
+class I2CError(IOError):
+
+    """Raised if i2c display write failed after retries."""
+
+
+class I2CTransport(object):
+
+    """Send command/data sequence to i2c display controller.
+
+    Sequence is retried as one unit with exponential wait, data after
+    partially failed block write would go to shifted address.
+    """
+
+    RETRIES = 3
+    RETRY_WAIT_SEC = 0.001
+
+    def __init__(self, busid, address):
+        """Open i2c bus."""
+        self.busid = busid
+        self.address = address
+        self._bus = smbus.SMBus(busid)
+        # successful sequences, failed tries, sequences failed all retries
+        self.sent = 0
+        self.errors = 0
+        self.failures = 0
+        # sec spent in failed tries and retry waits
+        self.error_sec = 0.0
+
+    def send(self, commands=(), data=None):
+        """Send command bytes and data block."""
+        for retry in xrange(self.RETRIES):
+            start = clock.monotonic()
+            try:
+                for command in commands:
+                    self._bus.write_byte_data(self.address, 0, command)
+                if data is not None:
+                    self._bus.write_i2c_block_data(self.address, 0x40,
+                                                   list(data))
+                self.sent += 1
+                return
+            except IOError, err:
+                self.errors += 1
+                if retry + 1 < self.RETRIES:
+                    time.sleep(self.RETRY_WAIT_SEC * 2 ** retry)
+                self.error_sec += clock.monotonic() - start
+        self.failures += 1
+        raise I2CError('i2c write to 0x%02x failed %i times: %s' % (
+            self.address, self.RETRIES, str(err)))
+
+    def reopen(self):
+        """Reopen i2c bus device."""
+        try:
+            self._bus.close()
+        except IOError:
+            pass
+        self._bus = smbus.SMBus(self.busid)
 
 
 class I2CDisplay(object):
 
-    """Control i2c interface display."""
+    """Control i2c interface display.
+
+    _old_line/_char keep requested panel content even if write failed.
+    After write failed, next write reinitializes controller and redraws
+    them, while RECOVER_*_SEC backoff writes fail without bus access.
+    """
+
+    MERGE_GAP = 2
+    # us2066 power-on sequence of (commands, data), function selection
+    # parameters are data bytes. Values are reset defaults, so it also
+    # restores controller after brown-out.
+    POWER_ON = [
+        # RE=1, function selection A: internal VDD regulator on
+        ([0x2a, 0x71], [0x5c]),
+        # RE=0 display off, RE=1 SD=1 clock divide, SD=0 5-dot 1/2 line,
+        # COM0-31 SEG99-0, function selection B: ROM A 8 CGRAM
+        ([0x28, 0x08, 0x2a, 0x79, 0xd5, 0x70, 0x78, 0x08, 0x06, 0x72],
+         [0x00]),
+        # SD=1 SEG pins, function selection C, phase length, VCOMH
+        # deselect level, SD=0 RE=0, clear, return home, increment cursor
+        ([0x2a, 0x79, 0xda, 0x10, 0xdc, 0x00, 0xd9, 0xf1, 0xdb, 0x40,
+          0x78, 0x28, 0x01, 0x02, 0x06], None),
+    ]
+    # extended function set of panel height, 4 line mode of us2066
+    LINE_MODE_COMMANDS = {4: [0x2a, 0x09, 0x28]}
+    CLEAR_SEC = 0.002
+    RECOVER_MIN_SEC = 0.05
+    RECOVER_MAX_SEC = 5.0
 
     def __init__(self, busid, address, left, width, logger=None):
         """Setup display bus/address."""
-        self._bus = smbus.SMBus(busid)
+        self.transport = I2CTransport(busid, address)
         self.address = address
         self.left = left
         self.width = width
         self.height = len(left)
+        self._line_mode = self.LINE_MODE_COMMANDS.get(self.height, [])
         self.logger = logger if logger else logging.getLogger(__name__)
         self._char = {}
         self._old_line = {}
@@ -655,12 +1168,95 @@ class I2CDisplay(object):
             self._line_scroll_left[i] = True
         self._power = False
         self._brightness = 0x7F
+        self._initialized = False
+        self._down = False
+        self._recovering = False
+        self._recover_time = 0.0
+        self._recover_sec = self.RECOVER_MIN_SEC
+        self.recoveries = 0
+
+    def _send(self, commands=(), data=None):
+        """Send to controller, recover controller first if write failed."""
+        if self._down and not self._recovering:
+            self._recover()
+        try:
+            self.transport.send(commands, data)
+        except I2CError, err:
+            if not self._down:
+                self._down = True
+                self._recover_time = clock.monotonic() + self._recover_sec
+                self.logger.warn("i2c display is down: %s" % str(err))
+            raise
+
+    def _recover_before(self, cache, key, data):
+        """Recover controller before cached write.
+
+        If controller is still down, data is kept in cache(_old_line or
+        _char) and drawn by later recovery.
+        """
+        if not self._down or self._recovering:
+            return
+        try:
+            self._recover()
+        except I2CError:
+            getattr(self, cache)[key] = data
+            raise
+
+    def _recover(self):
+        """Reinitialize controller and redraw requested content."""
+        now = clock.monotonic()
+        if now < self._recover_time:
+            raise I2CError('i2c display is down, retry in %.2f sec' % (
+                self._recover_time - now))
+        self._recover_sec = min(self._recover_sec * 2, self.RECOVER_MAX_SEC)
+        self._recover_time = now + self._recover_sec
+        self.transport.reopen()
+        self._initialize()
+        self._down = False
+        self.recoveries += 1
+        self._recover_sec = self.RECOVER_MIN_SEC
+        self.logger.info(
+            "i2c display recovered: %i errors, %i failures, %i recoveries,"
+            " %.3f sec in failed writes" % (
+                self.transport.errors, self.transport.failures,
+                self.recoveries, self.transport.error_sec))
+
+    def _initialize(self):
+        """Run power-on sequence and redraw requested content."""
+        chars, lines = self._char, self._old_line
+        # panel content is unknown
+        self._char = {}
+        self._old_line = dict((i, [None] * self.width)
+                              for i in xrange(self.height))
+        self._recovering = True
+        try:
+            for commands, data in self.POWER_ON:
+                self._send(commands, data)
+            time.sleep(self.CLEAR_SEC)
+            self.set_brightness(self._brightness)
+            self._send(self._line_mode + [0x0c if self._power else 0x08])
+            for raw_pos, data in sorted(chars.items()):
+                self.set_char((raw_pos & 0x3f) >> 3, data)
+            for line, data in sorted(lines.items()):
+                if isinstance(data, str):
+                    data = map(ord, data)
+                self.write_raw(data, line)
+                self.shift_reset(line)
+        except I2CError:
+            self._char, self._old_line = chars, lines
+            raise
+        finally:
+            self._recovering = False
+        self._initialized = True
 
     def on(self):
-        """Turn on display."""
-        self._bus.write_byte_data(self.address, 0, 0x0c)
-        self.set_brightness(self._brightness)
+        """Turn on display, first call initializes controller."""
         self._power = True
+        if not self._initialized and not self._down:
+            self._initialize()
+            return
+        self._send(self._line_mode + [0x0c])
+        self.set_brightness(self._brightness)
 
     def is_on(self):
         """Return ture if display is on."""
@@ -668,8 +1264,8 @@ class I2CDisplay(object):
 
     def off(self):
         """Turn on display."""
-        self._bus.write_byte_data(self.address, 0, 0x08)
         self._power = False
+        self._send([0x08])
 
     def write(self, string, line=0):
         """Write text."""
@@ -679,14 +1275,48 @@ class I2CDisplay(object):
 
     def write_raw(self, data, line=0):
         """Write binary to display."""
+        self._recover_before('_old_line', line, data)
         if self._old_line[line] == data:
             return
         self._old_line[line] = data
         raw_pos = 0x80 | self.left[line]
-        self._bus.write_byte_data(self.address, 0, raw_pos)
-        if len(data) > self.width:
-            data = data[:self.width]
-        self._bus.write_i2c_block_data(self.address, 0x40, data)
+        self._send([raw_pos], data[:self.width])
+
+    def write_changed(self, data, line=0):
+        """Write only changed cells of binary line.
+
+        each changed run costs one address command, so runs closer than
+        MERGE_GAP cells are written as one run.
+        """
+        old = self._old_line[line]
+        data = list(data[:self.width])
+        if self._down or len(old) != len(data):
+            self.write_raw(data, line)
+            return
+        self._old_line[line] = data
+        start = end = None
+        for i in xrange(len(data)):
+            if old[i] == data[i]:
+                continue
+            if start is not None and i - end > self.MERGE_GAP:
+                self._write_cells(data, line, start, end)
+                start = None
+            if start is None:
+                start = i
+            end = i + 1
+        if start is not None:
+            self._write_cells(data, line, start, end)
+
+    def _write_cells(self, data, line, start, end):
+        """Write data[start:end] to line."""
+        raw_pos = 0x80 | (self.left[line] + start)
+        self._send([raw_pos], data[start:end])
+
+    def write_frame(self, lines):
+        """Write prerendered list of (line, binary)."""
+        for line, data in lines:
+            self.write_raw(data, line)
+            self.shift_reset(line)
 
     def shift(self, line=0, wait=30):
         """shift text pos."""
@@ -709,10 +1339,9 @@ class I2CDisplay(object):
                     self._line_scroll_wait[line] = 0
 
             raw_pos = 0x80 | self.left[line]
-            self._bus.write_byte_data(self.address, 0, raw_pos)
             shift_pos = self._line_scroll_pos[line]
             data = self._old_line[line][shift_pos:self.width+shift_pos]
-            self._bus.write_i2c_block_data(self.address, 0x40, data)
+            self._send([raw_pos], data)
 
     def shift_reset(self, line):
         """Reset text pos."""
@@ -724,51 +1353,223 @@ class I2CDisplay(object):
         """Set user defined char to CGRAM."""
         raw_pos = 0x40 | pos*8
         data = list(data)
-        if raw_pos in self._char and self._char[raw_pos] == data:
+        self._recover_before('_char', raw_pos, data)
+        if self._char.get(raw_pos) == data:
             return
         self._char[raw_pos] = data
-        self._bus.write_byte_data(self.address, 0, raw_pos)
-        self._bus.write_i2c_block_data(self.address, 0x40, list(data))
+        self._send([raw_pos], data)
 
     def set_brightness(self, brightness):
         """Set display brightness."""
         self._brightness = brightness
-        self._bus.write_byte_data(self.address, 0, 0x2a)
-        self._bus.write_byte_data(self.address, 0, 0x79)
-        self._bus.write_byte_data(self.address, 0, 0x81)
-        self._bus.write_byte_data(self.address, 0, brightness)
-        self._bus.write_byte_data(self.address, 0, 0x78)
-        self._bus.write_byte_data(self.address, 0, 0x28)
+        self._send([0x2a, 0x79, 0x81, brightness, 0x78, 0x28])
 
 
-def kakasi(string):
-    """Convert Kanji/Hiragana/Katakana/Kigou to ascii text.
+class Layout(object):
 
-    # pacman -Sy kakasi
+    """Song text lines rendered once and shared by all panels.
+
+    line 0 is left aligned and scrolled, others are centered. Panels with
+    same field and width at a line share one rendered line.
+    """
+
+    FORMATS = {
+        'song': '{title} / {album} #{track:0>2}',
+        'title': '{title}',
+        'album': '{album}',
+        'artist': '{artist}',
+        'track': 'track {track:0>2}',
+        '': '',
+    }
+
+    def __init__(self, song, transliterate, panels):
+        """Transliterate song tags and render lines of each panel."""
+        song = dict(song)
+        for key in ['title', 'album', 'artist']:
+            song[key] = transliterate(song.get(key, ''))
+        song.setdefault('track', '')
+        texts = dict((field, text.format(**song).upper())
+                     for field, text in self.FORMATS.items())
+        lines = {}
+        self._frames = {}
+        for panel in panels:
+            width = panel.display.width
+            frame = []
+            for line, field in enumerate(panel.fields):
+                if line == panel.status_line and panel.has_status_line():
+                    continue
+                key = (field, width, line == 0)
+                if key not in lines:
+                    text = texts[field]
+                    lines[key] = map(ord, text.ljust(width) if line == 0
+                                     else text.center(width))
+                frame.append((line, lines[key]))
+            self._frames[panel] = frame
+
+    def frame(self, panel):
+        """Return list of (line, binary) of panel."""
+        return self._frames[panel]
+
+
+class Panel(object):
+
+    """I2C display and field shown at each line.
+
+    STATUS line shows progressbar, spectrum and messages. Panel without
+    STATUS line shows them at last line after its field is frozen for
+    App.DISPLAY_FREEZE_SEC.
     """
-    if not os.path.exists('/usr/bin/kakasi'):
-        return string
 
-    p = subprocess.Popen(['/usr/bin/kakasi',
-                          '-Ja', '-Ha', '-Ka', '-Ea', '-s', '-i', 'utf8'],
-                         stdin=subprocess.PIPE,
-                         stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    stdout, _ = p.communicate(string)
-    return stdout.strip()
+    STATUS = 'status'
+    FIELDS = sorted(i for i in Layout.FORMATS if i) + [STATUS]
+    DEFAULT_FIELDS = {2: ['song', 'artist'],
+                      4: ['title', 'album', 'artist', STATUS]}
+
+    def __init__(self, display, fields=None):
+        """Set display and fields, default fields are by display height."""
+        self.display = display
+        if fields is None:
+            fields = self.DEFAULT_FIELDS[display.height]
+        unknown = set(fields) - set(self.FIELDS)
+        if unknown:
+            raise ValueError('unknown field: %s' % ', '.join(unknown))
+        if len(fields) > display.height or fields.count(self.STATUS) > 1:
+            raise ValueError('%i fields for %i lines' % (
+                len(fields), display.height))
+        self.fields = list(fields) + [''] * (display.height - len(fields))
+        self.status_line = (fields.index(self.STATUS)
+                            if self.STATUS in fields else display.height - 1)
+        # status line keeps message until this time, < 0 means disable
+        self.hold_time = -1
+
+    def has_status_line(self):
+        """Return True if status line has no field."""
+        return self.fields[self.status_line] == self.STATUS
+
+
+class BusGroup(object):
+
+    """Run panel writes with one write queue for each i2c bus.
+
+    Panels on same bus are written in turn, buses are written concurrently
+    so panel on another bus does not add frame latency. First bus is
+    written by caller thread.
+    """
+
+    def __init__(self, panels):
+        """Start writer thread for each bus except first one."""
+        buses = {}
+        self._buses = []
+        for panel in panels:
+            busid = panel.display.transport.busid
+            if busid not in buses:
+                buses[busid] = []
+                self._buses.append(buses[busid])
+            buses[busid].append(panel)
+        self._done = Queue.Queue()
+        self._queues = []
+        for _ in self._buses[1:]:
+            queue = Queue.Queue()
+            writer = threading.Thread(target=self._writer, args=(queue,))
+            writer.setDaemon(True)
+            writer.start()
+            self._queues.append(queue)
+
+    def _writer(self, queue):
+        """Writer thread mainloop."""
+        while True:
+            func, panels = queue.get()
+            self._done.put(self._write(func, panels))
+
+    def _write(self, func, panels):
+        """Call func for each panel, return first exc_info or None."""
+        error = None
+        for panel in panels:
+            try:
+                func(panel)
+            except Exception:
+                # other panels are written even if one panel is down
+                if error is None:
+                    error = sys.exc_info()
+        return error
+
+    def run(self, func, panels=None):
+        """Call func(panel) for panels of all buses and wait them.
+
+        first exception raised by func is raised after all buses are done.
+        """
+        if panels is not None:
+            panels = set(panels)
+        jobs = [bus if panels is None else
+                [i for i in bus if i in panels] for bus in self._buses]
+        sent = 0
+        for queue, bus in zip(self._queues, jobs[1:]):
+            if bus:
+                queue.put((func, bus))
+                sent += 1
+        errors = [self._write(func, jobs[0])]
+        errors.extend(self._done.get() for _ in xrange(sent))
+        for error in errors:
+            if error:
+                raise error[0], error[1], error[2]
+
+
+def parse_display(spec):
+    """Return (bus, address, width, height, fields) of display option."""
+    parts = spec.split(':')
+    if len(parts) not in [3, 4]:
+        raise ValueError('display is BUS:ADDRESS:COLSxROWS[:FIELDS]')
+    width, _, height = parts[2].partition('x')
+    busid, address, width, height = (
+        int(parts[0]), int(parts[1], 0), int(width), int(height))
+    if height not in I2C_DDRAM_ADDRESS:
+        raise ValueError('%i line panel is not supported' % height)
+    fields = parts[3].split(',') if len(parts) == 4 else None
+    return busid, address, width, height, fields
 
 
 def main():
     """Run app mainloop."""
-    logging.basicConfig(
-        filename='/var/log/mpd-lcd-i2c.log',
-        format='[%(levelname)s] %(asctime)s [%(name)s] %(message)s',
-        datefmt='%Y/%m/%d %H:%M:%S',
-        level=logging.DEBUG)
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--spectrum-fifo', metavar='PATH',
+        help='show spectrum of mpd fifo output instead of progressbar')
+    parser.add_argument(
+        '--format', default='44100:16:2',
+        help='fifo audio format, rate:bits:channels(default: %(default)s)')
+    parser.add_argument(
+        '--history', metavar='PATH', default=history.DEFAULT_PATH,
+        help='play history file, none disables(default: %(default)s)')
+    parser.add_argument(
+        '--display', metavar='BUS:ADDRESS:COLSxROWS[:FIELD,...]',
+        type=parse_display, action='append',
+        help='i2c display, repeat for more panels. FIELD of each line is'
+        ' %s(default: %i:0x%02x:%ix%i)' % (
+            ', '.join(Panel.FIELDS), I2C_BUS, I2C_ADDRESS,
+            I2C_DISPLAY_WIDTH, I2C_DISPLAY_HEIGHT))
+    args = parser.parse_args()
+    displays = args.display or [(I2C_BUS, I2C_ADDRESS, I2C_DISPLAY_WIDTH,
+                                 I2C_DISPLAY_HEIGHT, None)]
+    ringlog.setup('/var/log/mpd-lcd-i2c.log')
     logger = logging.getLogger(__name__)
     try:
-        app = App(logger=logger)
+        panels = [Panel(I2CDisplay(busid, address, I2C_DDRAM_ADDRESS[height],
+                                   width, logger), fields)
+                  for busid, address, width, height, fields in displays]
+        spectrum = None
+        if args.spectrum_fifo:
+            import pcmfifo
+            spectrum = pcmfifo.Spectrum(
+                pcmfifo.PCMReader(args.spectrum_fifo, args.format),
+                max(i.display.width for i in panels))
+        recorder = None
+        if args.history != 'none':
+            recorder = history.Recorder(args.history)
+        app = App(logger=logger, spectrum=spectrum, recorder=recorder,
+                  panels=panels)
         app.main()
     except Exception, err:
+        import traceback
         logger.critical("app exit with: %s" % str(err))
         logger.critical(traceback.format_exc())
         sys.exit(1)
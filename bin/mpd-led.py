@@ -2,13 +2,17 @@
 
 """light until mpd is running."""
 
+import argparse
+import math
 import os
 import logging
 import signal
 import sys
 import subprocess
 import time
-import traceback
+
+import clock
+import ringlog
 
 
 class LED(object):
@@ -26,6 +30,14 @@ class LED(object):
             f.write(port)
         with open('/sys/class/gpio/gpio%s/direction' % port, 'w') as f:
             f.write('out')
+        self._value = None
+
+    def set(self, on):
+        """Switch LED by keeping value file opened(used by PWM)."""
+        if self._value is None:
+            self._value = os.open(
+                '/sys/class/gpio/gpio%s/value' % self._port, os.O_WRONLY)
+        os.write(self._value, '1' if on else '0')
 
     def on(self):
         """LED on."""
@@ -46,13 +58,39 @@ def close_gpio(port):
             f.write(port)
 
 
+class ConsoleLED(object):
+
+    """Show LED brightness to stdout instead of GPIO for testing."""
+
+    def __init__(self, width=40):
+        """Set meter width."""
+        self.width = width
+
+    def on(self):
+        """Show LED on."""
+        self.show(1.0)
+
+    def off(self):
+        """Show LED off."""
+        self.show(0.0)
+
+    def set(self, on):
+        """Ignore PWM pulse."""
+
+    def show(self, duty):
+        """Show LED brightness as bar."""
+        bar = '#' * int(round(duty * self.width))
+        sys.stdout.write('\r[%s] %3i%%' % (bar.ljust(self.width), duty * 100))
+        sys.stdout.flush()
+
+
 class App(object):
 
     """LED for mpd."""
 
-    def __init__(self, port, logger=None):
+    def __init__(self, led, logger=None):
         """Intialize mpd/app event."""
-        self.led = LED(port)
+        self.led = led
         self.logger = logger
         signal.signal(signal.SIGTERM, self.exit)
         signal.signal(signal.SIGINT, self.exit)
@@ -82,18 +120,94 @@ class App(object):
                 time.sleep(1)
 
 
+class MeterApp(App):
+
+    """LED level meter for mpd fifo audio output.
+
+    LED brightness follows loudness by software PWM.
+    """
+
+    PWM_HZ = 100
+    PWM_LEVELS = 16
+    METER_SEC = 0.05
+    METER_FRAMES = 2048
+    FLOOR_DB = -48.0
+    # level decay per meter update
+    RELEASE = 0.8
+    # LED on if no audio for this sec(mpd is paused/stopped)
+    IDLE_SEC = 1.0
+
+    def __init__(self, led, reader, logger=None):
+        """Set fifo reader."""
+        import pcmfifo
+        App.__init__(self, led, logger)
+        self.reader = reader
+        self._levels = pcmfifo.levels
+        self._level = 0.0
+        self._idle = 0.0
+
+    def duty(self):
+        """Read fifo and return LED duty from latest frames."""
+        if not self.reader.read():
+            self._idle += self.METER_SEC
+            if self._idle >= self.IDLE_SEC:
+                return 1.0
+            return round(self._level * self.PWM_LEVELS) / self.PWM_LEVELS
+        self._idle = 0.0
+        rms, _ = self._levels(self.reader.latest(self.METER_FRAMES))
+        db = 20 * math.log10(rms) if rms > 0 else self.FLOOR_DB
+        level = min(1.0, max(0.0, 1.0 - db / self.FLOOR_DB))
+        self._level = max(level, self._level * self.RELEASE)
+        return round(self._level * self.PWM_LEVELS) / self.PWM_LEVELS
+
+    def run(self):
+        """app mainloop."""
+        period = 1.0 / self.PWM_HZ
+        show = getattr(self.led, 'show', None)
+        duty = 1.0
+        next_meter = clock.monotonic()
+        while True:
+            now = clock.monotonic()
+            if now >= next_meter:
+                duty = self.duty()
+                if show:
+                    show(duty)
+                next_meter = max(next_meter + self.METER_SEC, now)
+            if 0 < duty < 1:
+                self.led.set(True)
+                time.sleep(period * duty)
+                self.led.set(False)
+                time.sleep(period * (1 - duty))
+            else:
+                self.led.set(duty > 0)
+                time.sleep(max(0.0, next_meter - clock.monotonic()))
+
+
 def main():
     """Run app mainloop."""
-    logging.basicConfig(
-        filename='/var/log/mpd-led.log',
-        format='[%(levelname)s] %(asctime)s [%(name)s] %(message)s',
-        datefmt='%Y/%m/%d %H:%M:%S',
-        level=logging.DEBUG)
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--fifo', metavar='PATH',
+        help='show audio level of mpd fifo output instead of mpd status')
+    parser.add_argument(
+        '--format', default='44100:16:2',
+        help='fifo audio format, rate:bits:channels(default: %(default)s)')
+    parser.add_argument('--stdout', action='store_true',
+                        help='show LED to stdout instead of GPIO')
+    args = parser.parse_args()
+    ringlog.setup('/var/log/mpd-led.log')
     logger = logging.getLogger(__name__)
     try:
-        app = App(5, logger)
+        led = ConsoleLED() if args.stdout else LED(5)
+        if args.fifo:
+            import pcmfifo
+            app = MeterApp(led, pcmfifo.PCMReader(args.fifo, args.format),
+                           logger)
+        else:
+            app = App(led, logger)
         app.run()
     except Exception, err:
+        import traceback
         logger.critical("app exit with: %s" % str(err))
         logger.critical(traceback.format_exc())
 
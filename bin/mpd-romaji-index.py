@@ -0,0 +1,110 @@
+#!/usr/bin/python2
+
+"""Precompute ascii text of mpd library titles/albums/artists."""
+
+
+import argparse
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+import time
+
+import mpdclient
+import ringlog
+import romaji
+
+
+TAGS = ['Title', 'Album', 'Artist']
+# strings per kakasi process
+CHUNK_SIZE = 200
+
+
+class Indexer(object):
+
+    """Update romaji store from mpd library."""
+
+    def __init__(self, path, processes=None, logger=None):
+        """Initialize mpd client."""
+        self.logger = logger if logger else logging.getLogger(__name__)
+        self.path = path
+        self.processes = processes
+        self.client = mpdclient.MPDClient(timeout=60, logger=self.logger)
+        signal.signal(signal.SIGTERM, self.exit)
+        signal.signal(signal.SIGINT, self.exit)
+
+    def exit(self, signum, frame):
+        """Exit indexer."""
+        self.logger.info("stop indexer")
+        sys.exit(0)
+
+    def library_strings(self):
+        """Return set of tag strings which need conversion."""
+        ret = set()
+        for song in self.client.songs('listallinfo'):
+            for tag in TAGS:
+                value = song.get(tag, '').strip()
+                if value and '\n' not in value and not romaji.is_ascii(value):
+                    ret.add(value)
+        return ret
+
+    def update(self):
+        """Convert new strings and rewrite store if library is changed."""
+        start = time.time()
+        strings = self.library_strings()
+        store = romaji.Store(self.path)
+        previous = list(store.items())
+        store.close()
+        old = dict(i for i in previous if i[0] in strings)
+        new = sorted(strings.difference(old))
+        self.logger.info("%i strings in library, %i new" % (
+            len(strings), len(new)))
+        if not new and len(old) == len(previous) and os.path.exists(self.path):
+            return
+        chunks = [new[i:i + CHUNK_SIZE]
+                  for i in xrange(0, len(new), CHUNK_SIZE)]
+        if chunks:
+            pool = multiprocessing.Pool(self.processes)
+            try:
+                for chunk, converted in zip(
+                        chunks, pool.map(romaji.kakasi_lines, chunks)):
+                    old.update(zip(chunk, converted))
+            finally:
+                pool.close()
+                pool.join()
+        romaji.write(self.path, old.items())
+        self.logger.info("wrote %i strings to %s in %.1f sec" % (
+            len(old), self.path, time.time() - start))
+
+    def watch(self):
+        """Update store when mpd database is updated."""
+        while True:
+            try:
+                self.update()
+                self.client.idle('database')
+            except mpdclient.MPDError, err:
+                self.logger.warn("mpd command failed: %s" % str(err))
+                time.sleep(10)
+
+
+def main():
+    """Run indexer."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--path', default=romaji.DEFAULT_PATH,
+                        help='store file path')
+    parser.add_argument('--processes', type=int,
+                        help='kakasi worker processes(default: cpu count)')
+    parser.add_argument('--watch', action='store_true',
+                        help='keep updating after mpd database update')
+    args = parser.parse_args()
+    ringlog.setup('/var/log/mpd-romaji-index.log')
+    logger = logging.getLogger(__name__)
+    indexer = Indexer(args.path, args.processes, logger)
+    if args.watch:
+        indexer.watch()
+    else:
+        indexer.update()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+"""Minimal mpd protocol client with persistent connection."""
+
+import errno
+import os
+import select
+import socket
+
+
+DEFAULT_HOST = 'localhost'
+DEFAULT_PORT = 6600
+
+REFUSED = 'refused'
+TIMED_OUT = 'timed out'
+CLOSED = 'closed'
+PROTOCOL_ERROR = 'protocol error'
+
+
+class MPDError(Exception):
+
+    """Raised if mpd returns error or connection is broken."""
+
+    reason = PROTOCOL_ERROR
+
+
+class MPDConnectionError(MPDError):
+
+    """Raised if mpd is not reachable or connection is broken.
+
+    reason is REFUSED(mpd is not listening), TIMED_OUT(mpd does not
+    respond) or CLOSED.
+    """
+
+    def __init__(self, err):
+        """Classify socket error."""
+        if isinstance(err, socket.timeout):
+            self.reason = TIMED_OUT
+        elif (isinstance(err, socket.error) and
+              err.errno in [errno.ECONNREFUSED, errno.ENOENT]):
+            self.reason = REFUSED
+        else:
+            self.reason = CLOSED
+        MPDError.__init__(self, 'connection %s: %s' % (self.reason, str(err)))
+
+
+class MPDClient(object):
+
+    """Send commands to mpd over one persistent connection.
+
+    Connection is opened at first command and reopened if mpd closed it
+    (e.g. connection_timeout) while idle. Command is never resent after
+    it is written, mpd may have run it(e.g. next) before error/timeout.
+    host/port default to MPD_HOST/MPD_PORT environment like mpc does,
+    host starts with '/' means unix domain socket.
+    channels are subscribed again at each connect.
+    """
+
+    def __init__(self, host=None, port=None, timeout=5.0, logger=None,
+                 channels=None):
+        """Set server address."""
+        self.host = host or os.environ.get('MPD_HOST', DEFAULT_HOST)
+        self.port = int(port or os.environ.get('MPD_PORT', DEFAULT_PORT))
+        self.timeout = timeout
+        self.logger = logger
+        self.channels = list(channels or [])
+        self._sock = None
+        self._sock_timeout = None
+        self._file = None
+
+    def connect(self):
+        """Connect to mpd and read hello message."""
+        self.close()
+        if self.host.startswith('/'):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            address = self.host
+        else:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            address = (self.host, self.port)
+        sock.settimeout(self.timeout)
+        self._sock_timeout = self.timeout
+        try:
+            sock.connect(address)
+        except:
+            sock.close()
+            raise
+        self._sock = sock
+        self._file = sock.makefile('rb')
+        hello = self._file.readline()
+        if not hello.startswith('OK MPD '):
+            self.close()
+            raise MPDError('unexpected hello message: %r' % hello)
+        if self.logger:
+            self.logger.info("connected to mpd: %s" % hello.strip())
+        for channel in self.channels:
+            self._sock.sendall('subscribe %s\n' % quote(channel))
+            self._read_response()
+
+    def close(self):
+        """Close connection."""
+        if self._file:
+            self._file.close()
+            self._file = None
+        if self._sock:
+            self._sock.close()
+            self._sock = None
+
+    def is_connected(self):
+        """Return True if connection is opened."""
+        return self._sock is not None
+
+    def command(self, *args):
+        """Run command and return response as list of (key, value)."""
+        return self._command(args, self.timeout)
+
+    def idle(self, *subsystems):
+        """Wait until mpd state is changed and return changed subsystems."""
+        return [value for key, value in
+                self._command(('idle',) + subsystems, None)
+                if key == 'changed']
+
+    def _is_stale(self):
+        """Return True if idle connection is closed or out of sync.
+
+        Nothing is readable between commands, readable means EOF.
+        """
+        try:
+            return bool(select.select([self._sock], [], [], 0)[0])
+        except (select.error, socket.error):
+            return True
+
+    def _command(self, args, timeout):
+        """Send command line and read response."""
+        line = ' '.join([args[0]] + [quote(i) for i in args[1:]]) + '\n'
+        if self._sock and self._is_stale():
+            self.close()
+        reused = self._sock is not None
+        try:
+            if not self._sock:
+                self.connect()
+            if self._sock_timeout != timeout:
+                self._sock.settimeout(timeout)
+                self._sock_timeout = timeout
+            self._sock.sendall(line)
+        except (socket.error, EOFError), err:
+            self.close()
+            if not reused:
+                raise MPDConnectionError(err)
+            # closed just before write, command is not run
+            return self._command(args, timeout)
+        try:
+            return self._read_response()
+        except (socket.error, EOFError), err:
+            self.close()
+            raise MPDConnectionError(err)
+
+    def _read_response(self):
+        """Read response lines until OK."""
+        ret = []
+        while True:
+            line = self._file.readline()
+            if not line:
+                raise EOFError('connection closed')
+            line = line.rstrip('\n')
+            if line == 'OK':
+                return ret
+            if line.startswith('ACK '):
+                raise MPDError(line)
+            key, _, value = line.partition(': ')
+            ret.append((key, value))
+
+    def status(self):
+        """Return status command response as dict."""
+        return dict(self.command('status'))
+
+    def messages(self):
+        """Return (channel, message) list of subscribed channels."""
+        ret = []
+        for key, value in self.command('readmessages'):
+            if key == 'channel':
+                channel = value
+            elif key == 'message':
+                ret.append((channel, value))
+        return ret
+
+    def songs(self, *args):
+        """Run song list command(playlistinfo etc.) and return dict list."""
+        ret = []
+        for key, value in self.command(*args):
+            if key == 'file':
+                ret.append({})
+            if ret:
+                ret[-1][key] = value
+        return ret
+
+
+def quote(arg):
+    """Quote command argument."""
+    arg = str(arg)
+    return '"%s"' % arg.replace('\\', '\\\\').replace('"', '\\"')
@@ -0,0 +1,175 @@
+"""Read PCM from mpd fifo audio output into numpy ring buffer.
+
+mpd.conf:
+
+    audio_output {
+        type    "fifo"
+        name    "fifo"
+        path    "/tmp/mpd.fifo"
+        format  "44100:16:2"
+    }
+"""
+
+import errno
+import os
+import stat
+
+import numpy
+
+
+DEFAULT_PATH = '/tmp/mpd.fifo'
+DEFAULT_FORMAT = '44100:16:2'
+DTYPES = {8: '<i1', 16: '<i2', 32: '<i4'}
+
+
+class PCMReader(object):
+
+    """Keep latest frames of fifo in ring buffer.
+
+    read() drains all available data without blocking, so caller never
+    falls behind: older frames are overwritten if caller is slow.
+    """
+
+    def __init__(self, path=DEFAULT_PATH, format=DEFAULT_FORMAT,
+                 buffer_sec=0.5):
+        """Open fifo and allocate ring buffer.
+
+        Missing fifo is created, so reader can start before mpd opens
+        output.
+        """
+        rate, bits, channels = [int(i) for i in format.split(':')]
+        if bits not in DTYPES:
+            raise ValueError('unsupported sample bits: %i' % bits)
+        self.rate = rate
+        self.channels = channels
+        self._dtype = numpy.dtype(DTYPES[bits])
+        self._scale = float(2 ** (bits - 1))
+        self._frame_bytes = self._dtype.itemsize * channels
+        self._ring = numpy.zeros((int(rate * buffer_sec), channels),
+                                 self._dtype)
+        self._pos = 0
+        self._rest = ''
+        self.frames = 0
+        make_fifo(path)
+        self._fd = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+        # keep fifo writer opened so select does not return EOF forever
+        # when mpd closes fifo
+        self._dummy_writer = os.open(path, os.O_WRONLY | os.O_NONBLOCK)
+
+    def fileno(self):
+        """Return fifo file descriptor."""
+        return self._fd
+
+    def close(self):
+        """Close fifo."""
+        os.close(self._dummy_writer)
+        os.close(self._fd)
+
+    def read(self):
+        """Read all available data and return new frame count."""
+        chunks = [self._rest]
+        while True:
+            try:
+                data = os.read(self._fd, 65536)
+            except OSError, err:
+                if err.errno in [errno.EAGAIN, errno.EWOULDBLOCK]:
+                    break
+                raise
+            if not data:
+                break
+            chunks.append(data)
+        data = ''.join(chunks)
+        usable = len(data) - len(data) % self._frame_bytes
+        self._rest = data[usable:]
+        if not usable:
+            return 0
+        size = len(self._ring)
+        # only latest frames fit in ring buffer
+        skip = max(0, usable - size * self._frame_bytes)
+        frames = numpy.frombuffer(data, self._dtype, (usable - skip) /
+                                  self._dtype.itemsize, skip)
+        frames = frames.reshape(-1, self.channels)
+        count = len(frames)
+        first = min(count, size - self._pos)
+        self._ring[self._pos:self._pos + first] = frames[:first]
+        self._ring[:count - first] = frames[first:]
+        self._pos = (self._pos + count) % size
+        self.frames += usable / self._frame_bytes
+        return usable / self._frame_bytes
+
+    def latest(self, count):
+        """Return latest frames as float32 array in -1.0 to 1.0."""
+        count = min(count, len(self._ring))
+        index = numpy.arange(self._pos - count, self._pos) % len(self._ring)
+        frames = self._ring.take(index, axis=0).astype(numpy.float32)
+        return frames / self._scale
+
+
+def levels(frames):
+    """Return (rms, peak) of float frames mixed down to mono."""
+    mono = frames.mean(axis=1)
+    return (float(numpy.sqrt(numpy.dot(mono, mono) / len(mono))),
+            float(numpy.abs(mono).max()))
+
+
+class Spectrum(object):
+
+    """Log spaced band levels of latest frames.
+
+    Overlapped hann windows are transformed by one rfft call and averaged,
+    so bars do not flicker by single window.
+    """
+
+    FFT_SIZE = 1024
+    WINDOWS = 4
+    LOW_HZ = 60.0
+    HIGH_HZ = 16000.0
+
+    def __init__(self, reader, bands=16):
+        """Precompute window and band edges for reader rate."""
+        self.reader = reader
+        size = self.FFT_SIZE
+        hop = size / 2
+        self._count = size + hop * (self.WINDOWS - 1)
+        self._index = (numpy.arange(size)[numpy.newaxis, :] +
+                       (numpy.arange(self.WINDOWS) * hop)[:, numpy.newaxis])
+        self._window = numpy.hanning(size).astype(numpy.float32)
+        # full scale sine wave to 1.0
+        self._scale = 2.0 / self._window.sum()
+        high = min(self.HIGH_HZ, reader.rate / 2.0)
+        edges = [int(i) for i in numpy.logspace(
+            numpy.log10(self.LOW_HZ), numpy.log10(high),
+            bands + 1) * size / reader.rate]
+        # low bands are narrower than fft bin
+        for i in xrange(1, len(edges)):
+            edges[i] = max(edges[i], edges[i - 1] + 1)
+        self._edges = numpy.array(edges)
+
+    def levels(self):
+        """Return band peak levels in dB of latest frames."""
+        mono = self.reader.latest(self._count).mean(axis=1)
+        if len(mono) < self._count:
+            mono = numpy.concatenate(
+                [numpy.zeros(self._count - len(mono), mono.dtype), mono])
+        frames = mono[self._index] * self._window
+        power = numpy.abs(numpy.fft.rfft(frames, axis=1)).mean(axis=0)
+        power = power[:self._edges[-1]] * self._scale
+        peak = numpy.maximum.reduceat(power, self._edges[:-1])
+        return 20 * numpy.log10(numpy.maximum(peak, 1e-10))
+
+    def heights(self, rows, floor_db):
+        """Return band levels as bar height list in 0 to rows."""
+        level = (1.0 - self.levels() / floor_db) * rows
+        return [int(i) for i in numpy.clip(numpy.round(level), 0, rows)]
+
+
+def make_fifo(path):
+    """Create fifo writable by mpd user like mpd does if it is missing."""
+    try:
+        os.mkfifo(path)
+        os.chmod(path, 0666)
+    except OSError, err:
+        if err.errno != errno.EEXIST:
+            raise
+    if not stat.S_ISFIFO(os.stat(path).st_mode):
+        raise ValueError('not a fifo: %s' % path)
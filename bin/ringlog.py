@@ -0,0 +1,142 @@
+"""Non blocking logging with in-memory ring buffer of recent records.
+
+Logging call only appends record to ring buffer and never waits for file
+write. Writer thread is woken by pipe and writes ring buffer
+to log file only if WARNING or higher is logged, app crashes or SIGUSR2
+is received, so normal operation does no sd card write:
+
+    # kill -USR2 $(pidof -x mpd-button.pyz)
+"""
+
+import collections
+import errno
+import fcntl
+import logging
+import os
+import signal
+import sys
+import threading
+
+
+FORMAT = '[%(levelname)s] %(asctime)s [%(name)s] %(message)s'
+DATEFMT = '%Y/%m/%d %H:%M:%S'
+CAPACITY = 2000
+STOP_TIMEOUT_SEC = 2.0
+
+_FLUSH = 'flush'
+_STOP = 'stop'
+
+
+class RingHandler(logging.Handler):
+
+    """Keep records in ring buffer for background writer."""
+
+    def __init__(self, filename, capacity=CAPACITY,
+                 flush_level=logging.WARNING):
+        """Start writer thread."""
+        logging.Handler.__init__(self)
+        self.filename = filename
+        self.flush_level = flush_level
+        self._commands = collections.deque()
+        self._ring = collections.deque(maxlen=capacity)
+        self._file = None
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        flags = fcntl.fcntl(self._wakeup_w, fcntl.F_GETFL)
+        fcntl.fcntl(self._wakeup_w, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        self._writer = threading.Thread(target=self._run)
+        self._writer.setDaemon(True)
+        self._writer.start()
+
+    def emit(self, record):
+        """Append record without blocking."""
+        # render now, args and traceback may be changed until written
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(
+                record.exc_info)
+            record.exc_info = None
+        self._ring.append(record)
+        if record.levelno >= self.flush_level:
+            self._put(_FLUSH)
+
+    def request_flush(self, signum=None, frame=None):
+        """Write ring buffer to file, safe to call from signal handler."""
+        self._put(_FLUSH)
+
+    def close(self):
+        """Stop writer after requested flush is done."""
+        if self._writer.is_alive():
+            self._put(_STOP)
+            self._writer.join(STOP_TIMEOUT_SEC)
+        logging.Handler.close(self)
+
+    def _put(self, command):
+        """Append command and wake writer.
+
+        Takes no lock(deque append is atomic), signal handler may run
+        while interrupted thread holds handler lock.
+        """
+        self._commands.append(command)
+        try:
+            os.write(self._wakeup_w, '\0')
+        except OSError, err:
+            # pipe is full, writer is already woken
+            if err.errno != errno.EAGAIN:
+                raise
+
+    def _run(self):
+        """Writer thread mainloop."""
+        while True:
+            try:
+                os.read(self._wakeup_r, 4096)
+            except OSError, err:
+                if err.errno == errno.EINTR:
+                    continue
+                raise
+            while self._commands:
+                if self._commands.popleft() is _STOP:
+                    return
+                self._write()
+
+    def _write(self):
+        """Write and clear ring buffer."""
+        lines = []
+        while True:
+            # popleft is atomic while other threads keep appending
+            try:
+                lines.append(self.format(self._ring.popleft()) + '\n')
+            except IndexError:
+                break
+        if not lines:
+            return
+        try:
+            if self._file is None:
+                self._file = open(self.filename, 'a')
+            self._file.writelines(lines)
+            self._file.flush()
+        except (IOError, OSError), err:
+            sys.stderr.write('log write failed: %s\n' % str(err))
+
+
+def setup(filename, capacity=CAPACITY, level=logging.DEBUG):
+    """Log to ring buffer flushed to filename and return handler.
+
+    SIGUSR2 writes ring buffer, uncaught exception is logged as CRITICAL.
+    SIGUSR2 restarts interrupted system calls, but epoll/select still
+    fail with EINTR and caller has to retry them.
+    """
+    handler = RingHandler(filename, capacity)
+    handler.setFormatter(logging.Formatter(FORMAT, DATEFMT))
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(handler)
+    signal.signal(signal.SIGUSR2, handler.request_flush)
+    signal.siginterrupt(signal.SIGUSR2, False)
+
+    def excepthook(exc_type, exc_value, exc_traceback):
+        root.critical("uncaught exception",
+                      exc_info=(exc_type, exc_value, exc_traceback))
+        sys.__excepthook__(exc_type, exc_value, exc_traceback)
+    sys.excepthook = excepthook
+    return handler
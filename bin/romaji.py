@@ -0,0 +1,202 @@
+"""Kanji/Hiragana/Katakana to ascii text and its precomputed store.
+
+store file layout(little endian):
+
+    header:  magic 'RMJI', version(uint8), bucket count(uint32),
+             entry count(uint32)
+    buckets: key hash(uint64, 0 means empty) + entry offset(uint32),
+             open addressing with linear probing
+    entries: key length(uint16) + key + value length(uint16) + value
+"""
+
+import hashlib
+import mmap
+import os
+import struct
+import subprocess
+
+
+DEFAULT_PATH = '/var/lib/mpd-romaji/romaji.db'
+KAKASI = '/usr/bin/kakasi'
+KAKASI_ARGS = ['-Ja', '-Ha', '-Ka', '-Ea', '-s', '-i', 'utf8']
+
+MAGIC = 'RMJI'
+VERSION = 1
+
+_HEADER = struct.Struct('<4sBxxxII')
+_BUCKET = struct.Struct('<QI')
+_LENGTH = struct.Struct('<H')
+
+
+def kakasi(string):
+    """Convert Kanji/Hiragana/Katakana/Kigou to ascii text.
+
+    # pacman -Sy kakasi
+    """
+    if not os.path.exists(KAKASI):
+        return string
+
+    p = subprocess.Popen([KAKASI] + KAKASI_ARGS,
+                         stdin=subprocess.PIPE,
+                         stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout, _ = p.communicate(string)
+    return stdout.strip()
+
+
+def kakasi_lines(strings):
+    """Convert strings by one kakasi process.
+
+    kakasi converts line by line, so it is much faster than kakasi() for
+    each string. Falls back to kakasi() if line count is changed.
+    """
+    if not os.path.exists(KAKASI):
+        return list(strings)
+    p = subprocess.Popen([KAKASI] + KAKASI_ARGS,
+                         stdin=subprocess.PIPE,
+                         stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout, _ = p.communicate(''.join(i + '\n' for i in strings))
+    ret = [i.strip() for i in stdout.split('\n')[:-1]]
+    if len(ret) != len(strings):
+        return [kakasi(i) for i in strings]
+    return ret
+
+
+def is_ascii(string):
+    """Return True if string needs no conversion."""
+    try:
+        string.decode('ascii')
+    except UnicodeError:
+        return False
+    return True
+
+
+def _hash(key):
+    """Return non zero 64bit key hash."""
+    return struct.unpack('<Q', hashlib.md5(key).digest()[:8])[0] or 1
+
+
+def write(path, items):
+    """Write (key, value) items to store file atomically."""
+    items = sorted(items)
+    size = 1
+    while size < len(items) * 2:
+        size *= 2
+    buckets = [(0, 0)] * size
+    offset = _HEADER.size + _BUCKET.size * size
+    data = []
+    for key, value in items:
+        index = _hash(key) & (size - 1)
+        while buckets[index][0]:
+            index = (index + 1) & (size - 1)
+        buckets[index] = (_hash(key), offset)
+        entry = (_LENGTH.pack(len(key)) + key +
+                 _LENGTH.pack(len(value)) + value)
+        data.append(entry)
+        offset += len(entry)
+
+    dirname = os.path.dirname(path)
+    if dirname and not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, size, len(items)))
+        for bucket in buckets:
+            f.write(_BUCKET.pack(*bucket))
+        for entry in data:
+            f.write(entry)
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(tmp, path)
+
+
+class Store(object):
+
+    """Read only precomputed conversion store.
+
+    File is memory mapped and reopened if indexer replaced it.
+    """
+
+    def __init__(self, path=DEFAULT_PATH):
+        """Set store file path, file is opened at first lookup."""
+        self.path = path
+        self._map = None
+        self._stat = None
+        self._size = 0
+
+    def _open(self):
+        """Map store file if it is created or replaced."""
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            self.close()
+            return False
+        stat = (st.st_ino, st.st_mtime, st.st_size)
+        if self._map is not None and stat == self._stat:
+            return True
+        self.close()
+        if st.st_size < _HEADER.size:
+            # empty or partial file is not a store, callers use default
+            return False
+        try:
+            with open(self.path, 'rb') as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (IOError, ValueError, mmap.error):
+            return False
+        try:
+            magic, version, size, _ = _HEADER.unpack_from(data, 0)
+        except struct.error:
+            data.close()
+            return False
+        if (magic != MAGIC or version != VERSION or size <= 0 or
+                size & (size - 1) or
+                len(data) < _HEADER.size + _BUCKET.size * size):
+            data.close()
+            return False
+        self._map = data
+        self._stat = stat
+        self._size = size
+        return True
+
+    def close(self):
+        """Unmap store file."""
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+            self._stat = None
+
+    def _entry(self, offset):
+        """Return (key, value) at offset and next entry offset."""
+        length, = _LENGTH.unpack_from(self._map, offset)
+        offset += _LENGTH.size
+        key = self._map[offset:offset + length]
+        offset += length
+        length, = _LENGTH.unpack_from(self._map, offset)
+        offset += _LENGTH.size
+        return key, self._map[offset:offset + length], offset + length
+
+    def get(self, key, default=None):
+        """Return converted string or default."""
+        if not self._open():
+            return default
+        key_hash = _hash(key)
+        index = key_hash & (self._size - 1)
+        while True:
+            bucket_hash, offset = _BUCKET.unpack_from(
+                self._map, _HEADER.size + _BUCKET.size * index)
+            if not bucket_hash:
+                return default
+            if bucket_hash == key_hash:
+                entry_key, value, _ = self._entry(offset)
+                if entry_key == key:
+                    return value
+            index = (index + 1) & (self._size - 1)
+
+    def items(self):
+        """Yield all (key, value)."""
+        if not self._open():
+            return
+        _, _, size, count = _HEADER.unpack_from(self._map, 0)
+        offset = _HEADER.size + _BUCKET.size * size
+        for _ in xrange(count):
+            key, value, offset = self._entry(offset)
+            yield key, value
@@ -0,0 +1,36 @@
+"""systemd service notification(sd_notify) without libsystemd."""
+
+import os
+import socket
+
+
+_sock = None
+
+
+def notify(state):
+    """Send state(e.g. 'READY=1') to systemd.
+
+    Return False if service is not started by systemd with notify socket.
+    """
+    global _sock
+    path = os.environ.get('NOTIFY_SOCKET')
+    if not path:
+        return False
+    if path.startswith('@'):
+        path = '\0' + path[1:]
+    if _sock is None:
+        _sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    try:
+        _sock.sendto(state, path)
+    except socket.error:
+        return False
+    return True
+
+
+def watchdog_sec():
+    """Return WatchdogSec= of service or None if watchdog is disabled."""
+    usec = os.environ.get('WATCHDOG_USEC')
+    pid = os.environ.get('WATCHDOG_PID')
+    if not usec or (pid and int(pid) != os.getpid()):
+        return None
+    return int(usec) / 1e6
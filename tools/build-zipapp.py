@@ -0,0 +1,90 @@
+#!/usr/bin/python2
+
+"""Build byte-compiled single file apps from bin/ scripts.
+
+bin/mpd-button.py is packed to build/mpd-button.pyz as mpd_button.pyc with
+shared modules in bin/(python files without '-' in name) and __main__.pyc
+which calls mpd_button.main().
+Non python files are copied as is.
+"""
+
+
+import argparse
+import imp
+import marshal
+import os
+import shutil
+import stat
+import struct
+import zipfile
+
+
+SHEBANG = '#!/usr/bin/python2\n'
+# fixed timestamp for reproducible archive
+ZIP_DATE_TIME = (2000, 1, 1, 0, 0, 0)
+MAIN_SOURCE = 'import %(module)s\n%(module)s.main()\n'
+
+
+def compile_source(source, filename):
+    """Return .pyc file data of given source."""
+    code = compile(source, filename, 'exec')
+    return imp.get_magic() + struct.pack('<I', 0) + marshal.dumps(code)
+
+
+def add_file(archive, name, data):
+    """Add file data to zip archive."""
+    info = zipfile.ZipInfo(name, ZIP_DATE_TIME)
+    # stored, zipimport does not need to import zlib and inflate
+    info.compress_type = zipfile.ZIP_STORED
+    info.external_attr = 0644 << 16
+    archive.writestr(info, data)
+
+
+def build_app(path, modules, dest):
+    """Build single file app for given script."""
+    module = os.path.basename(path)[:-3].replace('-', '_')
+    with open(dest, 'wb') as f:
+        f.write(SHEBANG)
+        archive = zipfile.ZipFile(f, 'w')
+        with open(path) as source:
+            add_file(archive, module + '.pyc',
+                     compile_source(source.read(), os.path.basename(path)))
+        for shared in modules:
+            with open(shared) as source:
+                add_file(archive, os.path.basename(shared) + 'c',
+                         compile_source(source.read(),
+                                        os.path.basename(shared)))
+        add_file(archive, '__main__.pyc',
+                 compile_source(MAIN_SOURCE % {'module': module},
+                                '__main__.py'))
+        archive.close()
+    os.chmod(dest, 0755)
+
+
+def main():
+    """Build all apps in source dir."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('src', help='script dir')
+    parser.add_argument('dest', help='output dir')
+    args = parser.parse_args()
+    if not os.path.isdir(args.dest):
+        os.makedirs(args.dest)
+    names = sorted(os.listdir(args.src))
+    modules = [os.path.join(args.src, name) for name in names
+               if name.endswith('.py') and '-' not in name]
+    for name in names:
+        path = os.path.join(args.src, name)
+        if not os.path.isfile(path) or path in modules:
+            continue
+        if name.endswith('.py'):
+            dest = os.path.join(args.dest, name[:-3] + '.pyz')
+            build_app(path, modules, dest)
+        else:
+            dest = os.path.join(args.dest, name)
+            shutil.copyfile(path, dest)
+            os.chmod(dest, os.stat(path).st_mode & 0777 | stat.S_IRUSR)
+        print dest
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+#!/usr/bin/python2
+
+"""Replay gpio trace through mpd-button logic against fake mpd."""
+
+
+import argparse
+import imp
+import logging
+import os
+import sys
+import time
+
+
+BIN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bin')
+sys.path.insert(0, BIN_DIR)
+
+import gpiotrace  # noqa
+
+
+def load_button():
+    """Load mpd-button script as module."""
+    return imp.load_source('mpd_button',
+                           os.path.join(BIN_DIR, 'mpd-button.py'))
+
+
+class FakeMPD(object):
+
+    """Record mpd commands with replay clock time."""
+
+    COMMANDS = ['prev_album', 'prev', 'pause', 'play', 'next', 'next_album',
+                'seek', 'browse']
+
+    def __init__(self):
+        """Initialize command log."""
+        self.now = 0.0
+        self.calls = []
+        for name in self.COMMANDS:
+            setattr(self, name, self._command(name))
+
+    def _command(self, name):
+        def command(*args):
+            self.calls.append((self.now, name))
+        return command
+
+    def skip_cause(self, cause):
+        """Do nothing, play history is not replayed."""
+
+
+class FakeBrowser(object):
+
+    """Record browse mode start, browse mode itself is not replayed."""
+
+    def __init__(self, mpd):
+        """Set fake mpd to record command."""
+        self.mpd = mpd
+
+    def is_active(self):
+        """Return False."""
+        return False
+
+    def deadline(self):
+        """Return None."""
+        return None
+
+    def poll(self, now):
+        """Do nothing."""
+
+    def start(self, now):
+        """Record browse command."""
+        self.mpd.calls.append((now, 'browse'))
+
+
+class Result(object):
+
+    """Replay result."""
+
+    def __init__(self, debounce):
+        """Initialize counters."""
+        self.debounce = debounce
+        self.edges = 0
+        self.gestures = 0
+        self.latency = []
+        self.cost = []
+        self.calls = []
+
+    def report(self, out):
+        """Write result summary."""
+        def ms(values, func):
+            return '%7.2f' % (func(values) * 1000) if values else '      -'
+
+        def median(values):
+            return sorted(values)[len(values) / 2]
+
+        out.write('debounce %.3fs: %i edges, %i gestures, %i commands\n' % (
+            self.debounce, self.edges, self.gestures, len(self.calls)))
+        out.write('  gesture decision latency ms:'
+                  ' min %s median %s max %s\n' % (
+                      ms(self.latency, min), ms(self.latency, median),
+                      ms(self.latency, max)))
+        out.write('  edge handling cost ms:'
+                  ' min %s median %s max %s\n' % (
+                      ms(self.cost, min), ms(self.cost, median),
+                      ms(self.cost, max)))
+        counts = {}
+        for _, name in self.calls:
+            counts[name] = counts.get(name, 0) + 1
+        for name in FakeMPD.COMMANDS:
+            if name in counts:
+                out.write('  %-10s %i\n' % (name, counts[name]))
+
+
+def replay(module, names, events, debounce, speed):
+    """Feed edge events to App like App.run does.
+
+    App.poll runs at App.deadline() before next edge and current pin
+    values are fed after it, so edges ignored by debounce are recovered.
+    Gesture latency includes edge handling cost.
+    speed <= 0 replays as fast as possible.
+    """
+    pins = dict((name, None) for name in names)
+    app = module.App(logger=logging.getLogger('replay'),
+                     windows={'debounce_sec': debounce}, **pins)
+    app.mpd = FakeMPD()
+    app.browser = FakeBrowser(app.mpd)
+    result = Result(debounce)
+    if not events:
+        return result
+    perform = app.perform
+    cost = [0.0]
+
+    def measure(decided):
+        result.gestures += 1
+        result.latency.append(decided.latency + time.time() - cost[0])
+        perform(decided)
+    app.perform = measure
+    values = dict((name, False) for name in names)
+    origin = events[0][0]
+    wall_origin = time.time()
+
+    def wait(until):
+        if speed > 0:
+            sec = wall_origin + (until - origin) / speed - time.time()
+            if sec > 0:
+                time.sleep(sec)
+
+    def step(now, edge=None):
+        wait(now)
+        app.mpd.now = now
+        cost[0] = time.time()
+        if edge:
+            result.edges += 1
+            app.feed(now, *edge)
+        else:
+            app.poll(now)
+            for name in names:
+                app.feed(now, name, values[name])
+        result.cost.append(time.time() - cost[0])
+
+    # run pending windows and seek steps a while after last edge
+    end = events[-1][0] + module.App.SEEK_RATE[-1][0]
+    for now, name, value in events + [(end, None, None)]:
+        deadline = app.deadline()
+        while deadline is not None and deadline <= now:
+            step(deadline)
+            deadline = app.deadline()
+        if name is not None:
+            values[name] = value
+            step(now, (name, value))
+    result.calls = app.mpd.calls
+    return result
+
+
+def main():
+    """Replay trace file for each debounce value."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('trace', help='trace file recorded by --record')
+    parser.add_argument(
+        '--speed', type=float, default=0,
+        help='replay speed, 1 is real time, 0 is as fast as possible')
+    parser.add_argument(
+        '--debounce', type=float, nargs='+', metavar='SEC',
+        help='debounce sec to compare(default: Recognizer.DEBOUNCE_SEC)')
+    parser.add_argument('--verbose', action='store_true',
+                        help='show each mpd command')
+    args = parser.parse_args()
+    logging.basicConfig(
+        format='[%(levelname)s] %(message)s',
+        level=logging.DEBUG if args.verbose else logging.WARNING)
+
+    module = load_button()
+    names, events = gpiotrace.load(args.trace)
+    default = module.gesture.Recognizer.DEBOUNCE_SEC
+    for debounce in args.debounce or [default]:
+        result = replay(module, names, events, debounce, args.speed)
+        if args.verbose:
+            for now, name in result.calls:
+                sys.stdout.write('%10.3f %s\n' % (now - events[0][0], name))
+        result.report(sys.stdout)
+
+
+if __name__ == '__main__':
+    main()
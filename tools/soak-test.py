@@ -0,0 +1,895 @@
+#!/usr/bin/python2
+
+"""Run services against fake mpd, gpio and smbus for simulated days.
+
+Each service runs in a child process whose clock.monotonic, time.time,
+time.sleep, select and epoll timeouts run --speed times faster. Fake mpd
+server in this process plays a queue and randomly pauses, changes volume,
+edits playlist, updates database, drops connections and restarts. Fake
+gpio presses buttons, turns encoder and sends control requests, fake
+smbus fails writes now and then.
+
+Each child samples its RSS, open fds, child processes and gc object
+counts by type. Soak fails if growth between settled samples after
+warmup exceeds budget.
+
+    $ python2 tools/soak-test.py --days 2 --speed 2000
+    $ python2 tools/soak-test.py mpd-button mpd-lcd-i2c
+"""
+
+
+import argparse
+import errno
+import fcntl
+import gc
+import imp
+import json
+import os
+import Queue
+import random
+import select
+import shlex
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+
+BIN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                       'bin')
+sys.path.insert(0, BIN_DIR)
+
+import clock  # noqa
+
+
+# {tmp} is replaced by work directory, {pid} by harness pid
+SERVICES = {
+    'mpd-lcd-i2c': ['--history', '{tmp}/history.bin',
+                    '--display', '1:0x3c:16x2',
+                    '--display', '2:0x3c:20x4'],
+    'mpd-button': ['--encoder', '17', '27',
+                   '--control', '@mpd-button-soak-{pid}'],
+    'mpd-led': ['--stdout'],
+    'mpd-romaji-index': ['--watch', '--path', '{tmp}/romaji.db'],
+}
+BUTTON_PINS = [22, 10, 9, 11, 23, 24]
+ENCODER_PINS = (17, 27)
+# settled value is median of this many samples
+SETTLE_SAMPLES = 3
+
+MPC = '''#!%(python)s
+import sys
+sys.path.insert(0, %(bin)r)
+import mpdclient
+client = mpdclient.MPDClient()
+try:
+    if sys.argv[1:] == ['idle']:
+        print ' '.join(client.idle())
+    else:
+        print '[%%s]' %% client.status().get('state')
+except mpdclient.MPDError, err:
+    sys.stderr.write('%%s\\n' %% str(err))
+    sys.exit(1)
+'''
+
+
+class Clock(object):
+
+    """Virtual time running speed times faster than real time."""
+
+    def __init__(self, speed):
+        """Start virtual time at current time."""
+        self.speed = speed
+        self._real = clock.monotonic
+        self._start = self._real()
+        self._wall = time.time()
+
+    def elapsed(self):
+        """Return virtual sec since start."""
+        return (self._real() - self._start) * self.speed
+
+    def monotonic(self):
+        """Return virtual monotonic time."""
+        return self._start + self.elapsed()
+
+    def time(self):
+        """Return virtual unix time."""
+        return self._wall + self.elapsed()
+
+
+def accelerate(vclock):
+    """Patch clock and timeouts of this process to virtual time."""
+    speed = float(vclock.speed)
+    real_sleep = time.sleep
+    real_select = select.select
+    real_epoll = select.epoll
+
+    def sleep(sec):
+        real_sleep(max(0.0, sec) / speed)
+
+    def select_(rlist, wlist, xlist, timeout=None):
+        if timeout is not None:
+            timeout = timeout / speed
+        return real_select(rlist, wlist, xlist, timeout)
+
+    class Epoll(object):
+
+        """epoll with virtual poll timeout."""
+
+        def __init__(self, *args):
+            self._epoll = real_epoll(*args)
+
+        def __getattr__(self, name):
+            return getattr(self._epoll, name)
+
+        def poll(self, timeout=-1, maxevents=-1):
+            if timeout > 0:
+                timeout = timeout / speed
+            return self._epoll.poll(timeout, maxevents)
+
+    clock.monotonic = vclock.monotonic
+    time.time = vclock.time
+    time.sleep = sleep
+    select.select = select_
+    select.epoll = Epoll
+    # Condition.wait(timeout) and Queue.get(timeout) poll by these
+    threading._time = vclock.time
+    threading._sleep = sleep
+    Queue._time = vclock.time
+
+
+class FakeSMBus(object):
+
+    """SMBus which drops writes and fails like a flaky bus.
+
+    Bus keeps a real fd open like /dev/i2c-N, so leaked reopen shows up
+    as fd growth.
+    """
+
+    ERROR_RATE = 0.0005
+    # outage for OUTAGE_SEC in every OUTAGE_EVERY_SEC virtual sec
+    OUTAGE_EVERY_SEC = 6 * 3600
+    OUTAGE_SEC = 60
+
+    def __init__(self, busid):
+        """Open fd of bus."""
+        self.busid = busid
+        self._fd = os.open(os.devnull, os.O_WRONLY)
+
+    def close(self):
+        """Close fd of bus."""
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def _write(self):
+        """Raise IOError at random or in outage."""
+        if (random.random() < self.ERROR_RATE or
+                clock.monotonic() % self.OUTAGE_EVERY_SEC < self.OUTAGE_SEC):
+            raise IOError(errno.EREMOTEIO, 'Remote I/O error')
+
+    def write_byte_data(self, address, register, value):
+        """Accept command byte."""
+        self._write()
+
+    def write_i2c_block_data(self, address, register, data):
+        """Accept data block."""
+        self._write()
+
+
+class FakePin(object):
+
+    """gpio value file, set() makes edge on pipe polled by service."""
+
+    def __init__(self):
+        """Create pipe, pin is released."""
+        self._r, self._w = os.pipe()
+        for fd in [self._r, self._w]:
+            flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+            fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        self.value = '0'
+
+    def fileno(self):
+        """Return pipe read end."""
+        return self._r
+
+    def seek(self, offset):
+        """Do nothing, read() always returns value."""
+
+    def read(self):
+        """Clear edge and return value."""
+        try:
+            os.read(self._r, 4096)
+        except OSError, err:
+            if err.errno != errno.EAGAIN:
+                raise
+        return self.value + '\n'
+
+    def set(self, value):
+        """Change value and make edge."""
+        self.value = '1' if value else '0'
+        try:
+            os.write(self._w, '\0')
+        except OSError, err:
+            if err.errno != errno.EAGAIN:
+                raise
+
+
+class FakeMPD(object):
+
+    """Unix socket mpd server playing fake queue on virtual clock."""
+
+    SONGS = 240
+    ALBUM_SIZE = 12
+    # event: mean virtual sec between events
+    EVENTS = {
+        'pause': 2 * 3600,
+        'volume': 1800,
+        'playlist': 3 * 3600,
+        'database': 8 * 3600,
+        'drop': 4 * 3600,
+        'restart': 12 * 3600,
+    }
+    RESTART_SEC = 30
+    TICK_SEC = 0.005
+
+    def __init__(self, path, vclock):
+        """Build library and queue."""
+        self.path = path
+        self.clock = vclock
+        self._lock = threading.Condition()
+        self._clients = []
+        self._listener = None
+        self._next_id = 0
+        self.library = [self._song(i) for i in xrange(self.SONGS)]
+        self.version = 1
+        # (song, playlist version song is changed at)
+        self.queue = [(self._queued(i), 1) for i in self.library]
+        self.state = 'play'
+        self.pos = 0
+        self.volume = 50
+        self._started = vclock.monotonic()
+        self._elapsed = 0.0
+        self.commands = 0
+        self.counts = dict((i, 0) for i in self.EVENTS)
+
+    def _song(self, index):
+        """Return library song, every 5th title needs romaji."""
+        title = ('\xe6\x9b\xb2 %i' if index % 5 == 0 else 'Song %i') % index
+        return {'file': 'soak/%04i.flac' % index, 'Title': title,
+                'Album': 'Album %i' % (index / self.ALBUM_SIZE),
+                'Artist': 'Artist %i' % (index % 7),
+                'Track': str(index % self.ALBUM_SIZE + 1),
+                'Time': str(120 + index * 37 % 240)}
+
+    def _queued(self, song):
+        """Return queue entry of library song with new id."""
+        self._next_id += 1
+        ret = dict(song)
+        ret['Id'] = str(self._next_id)
+        return ret
+
+    def start(self):
+        """Start server and player threads."""
+        for target in [self._serve, self._play]:
+            thread = threading.Thread(target=target)
+            thread.setDaemon(True)
+            thread.start()
+
+    def _listen(self):
+        """Open listening socket."""
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(self.path)
+        sock.listen(16)
+        sock.settimeout(0.05)
+        return sock
+
+    def _serve(self):
+        """Accept clients, listening socket is closed while restarting."""
+        while True:
+            with self._lock:
+                if self._listener is None:
+                    self._listener = self._listen()
+                listener = self._listener
+            try:
+                sock, _ = listener.accept()
+            except socket.timeout:
+                continue
+            except socket.error:
+                # closed by restart
+                time.sleep(self.RESTART_SEC / self.clock.speed)
+                continue
+            thread = threading.Thread(target=self._connection, args=(sock,))
+            thread.setDaemon(True)
+            thread.start()
+
+    def _connection(self, sock):
+        """Serve one client."""
+        sock.setblocking(True)
+        client = {'sock': sock, 'pending': set(), 'channels': set(),
+                  'messages': [], 'closed': False}
+        with self._lock:
+            self._clients.append(client)
+        f = sock.makefile('rb')
+        try:
+            sock.sendall('OK MPD 0.19.0\n')
+            while True:
+                line = f.readline()
+                if not line:
+                    break
+                args = shlex.split(line)
+                if not args:
+                    continue
+                with self._lock:
+                    self.commands += 1
+                    if args[0] == 'idle':
+                        response = self._idle(client, args[1:])
+                    elif args[0] == 'close':
+                        break
+                    else:
+                        response = self._command(client, args)
+                if response is None:
+                    break
+                sock.sendall(response)
+        except (socket.error, IOError, ValueError):
+            pass
+        finally:
+            with self._lock:
+                if client in self._clients:
+                    self._clients.remove(client)
+            f.close()
+            sock.close()
+
+    def _idle(self, client, subsystems):
+        """Wait changes, lock is held. Return None if client is closed."""
+        wanted = set(subsystems)
+        while not client['closed']:
+            changed = (client['pending'] & wanted if wanted
+                       else set(client['pending']))
+            if changed:
+                client['pending'] -= changed
+                return ''.join('changed: %s\n' % i
+                               for i in sorted(changed)) + 'OK\n'
+            self._lock.wait(1.0)
+        return None
+
+    def _emit(self, *subsystems, **kwargs):
+        """Add changed subsystems to clients, lock is held."""
+        for client in kwargs.get('clients', self._clients):
+            client['pending'].update(subsystems)
+        self._lock.notify_all()
+
+    def _elapsed_now(self):
+        """Return elapsed sec of current song."""
+        if self.state != 'play':
+            return self._elapsed
+        return self._elapsed + self.clock.monotonic() - self._started
+
+    def _set_state(self, state, pos=None, elapsed=None):
+        """Change player state and emit player."""
+        if elapsed is None:
+            elapsed = 0.0 if pos is not None else self._elapsed_now()
+        if pos is not None:
+            self.pos = pos
+        if not self.queue:
+            state = 'stop'
+        self.state = state
+        self._elapsed = elapsed
+        self._started = self.clock.monotonic()
+        self._emit('player')
+
+    @staticmethod
+    def _fields(song, pos=None):
+        """Return response lines of song."""
+        keys = ['file', 'Title', 'Album', 'Artist', 'Track', 'Time']
+        lines = ['%s: %s\n' % (key, song[key]) for key in keys]
+        if pos is not None:
+            lines.append('Pos: %i\nId: %s\n' % (pos, song['Id']))
+        return ''.join(lines)
+
+    def _status(self):
+        """Return status response lines."""
+        lines = ['volume: %i\n' % self.volume, 'repeat: 0\n', 'random: 0\n',
+                 'single: 0\n', 'consume: 0\n',
+                 'playlist: %i\n' % self.version,
+                 'playlistlength: %i\n' % len(self.queue),
+                 'state: %s\n' % self.state]
+        if self.state != 'stop':
+            song = self.queue[self.pos][0]
+            elapsed = self._elapsed_now()
+            lines.extend(['song: %i\n' % self.pos, 'songid: %s\n' % song['Id'],
+                          'time: %i:%s\n' % (elapsed, song['Time']),
+                          'elapsed: %.3f\n' % elapsed,
+                          'duration: %s.000\n' % song['Time']])
+            if self.pos + 1 < len(self.queue):
+                lines.extend(['nextsong: %i\n' % (self.pos + 1),
+                              'nextsongid: %s\n' % (
+                                  self.queue[self.pos + 1][0]['Id'])])
+        return ''.join(lines)
+
+    def _command(self, client, args):
+        """Run command, lock is held."""
+        command = args[0]
+        try:
+            ret = getattr(self, 'do_' + command, None)
+            if ret is None:
+                raise ValueError('unknown command "%s"' % command)
+            return (ret(client, *args[1:]) or '') + 'OK\n'
+        except (ValueError, IndexError, TypeError), err:
+            return 'ACK [5@0] {%s} %s\n' % (command, str(err))
+        except KeyError, err:
+            return 'ACK [50@0] {%s} %s\n' % (command, str(err))
+
+    def do_ping(self, client):
+        """Do nothing."""
+
+    def do_status(self, client):
+        """Return player status."""
+        return self._status()
+
+    def do_currentsong(self, client):
+        """Return current song."""
+        if self.queue:
+            return self._fields(self.queue[self.pos][0], self.pos)
+
+    def do_playlistinfo(self, client):
+        """Return queue."""
+        return ''.join(self._fields(song, pos)
+                       for pos, (song, _) in enumerate(self.queue))
+
+    def do_plchanges(self, client, version):
+        """Return queue songs changed after version."""
+        return ''.join(self._fields(song, pos)
+                       for pos, (song, changed) in enumerate(self.queue)
+                       if changed > int(version))
+
+    def do_playlistid(self, client, songid):
+        """Return queue song of id."""
+        for pos, (song, _) in enumerate(self.queue):
+            if song['Id'] == songid:
+                return self._fields(song, pos)
+        raise KeyError('No such song')
+
+    def do_listallinfo(self, client):
+        """Return library."""
+        return ''.join(self._fields(song) for song in self.library)
+
+    def do_subscribe(self, client, channel):
+        """Subscribe channel."""
+        client['channels'].add(channel)
+
+    def do_readmessages(self, client):
+        """Return and clear messages."""
+        messages, client['messages'] = client['messages'], []
+        return ''.join('channel: %s\nmessage: %s\n' % i for i in messages)
+
+    def do_sendmessage(self, client, channel, message):
+        """Send message to subscribers."""
+        receivers = [i for i in self._clients if channel in i['channels']]
+        if not receivers:
+            raise KeyError('nobody is subscribed to this channel')
+        for receiver in receivers:
+            receiver['messages'].append((channel, message))
+        self._emit('message', clients=receivers)
+
+    def do_play(self, client, pos=None):
+        """Play song at pos or resume."""
+        if pos is None:
+            self._set_state('play', None if self.state != 'stop' else 0)
+        else:
+            if not 0 <= int(pos) < len(self.queue):
+                raise KeyError('Bad song index')
+            self._set_state('play', int(pos))
+
+    def do_pause(self, client, pause=None):
+        """Pause or resume."""
+        if self.state == 'stop':
+            return
+        if pause is None:
+            pause = '1' if self.state == 'play' else '0'
+        self._set_state('pause' if pause == '1' else 'play')
+
+    def do_stop(self, client):
+        """Stop."""
+        self._set_state('stop', self.pos)
+
+    def do_next(self, client):
+        """Play next song, stop at end."""
+        if self.pos + 1 < len(self.queue):
+            self._set_state(self.state, self.pos + 1)
+        else:
+            self._set_state('stop', 0)
+
+    def do_previous(self, client):
+        """Play previous song."""
+        self._set_state(self.state, max(0, self.pos - 1))
+
+    def do_seekcur(self, client, sec):
+        """Seek current song."""
+        if self.state == 'stop':
+            raise KeyError('Not playing')
+        elapsed = float(sec)
+        if sec[0] in '+-':
+            elapsed += self._elapsed_now()
+        if not 0 <= elapsed <= int(self.queue[self.pos][0]['Time']):
+            raise ValueError('Bad song time')
+        self._set_state(self.state, elapsed=elapsed)
+
+    def do_setvol(self, client, volume):
+        """Set volume."""
+        self.volume = min(100, max(0, int(volume)))
+        self._emit('mixer')
+
+    def do_volume(self, client, change):
+        """Change volume relatively."""
+        self.do_setvol(client, self.volume + int(change))
+
+    def _play(self):
+        """Advance songs and make random events."""
+        last = self.clock.monotonic()
+        while True:
+            time.sleep(self.TICK_SEC)
+            now = self.clock.monotonic()
+            events = [event for event, mean in self.EVENTS.items()
+                      if random.random() < (now - last) / mean]
+            last = now
+            with self._lock:
+                if (self.state == 'play' and self._elapsed_now() >=
+                        int(self.queue[self.pos][0]['Time'])):
+                    self.do_next(None)
+                for event in events:
+                    self.counts[event] += 1
+                    getattr(self, '_event_' + event)()
+
+    def _event_pause(self):
+        """Pause or resume."""
+        if self.state == 'stop':
+            self._set_state('play', 0)
+        else:
+            self.do_pause(None)
+
+    def _event_volume(self):
+        """Change volume by other client."""
+        self.do_setvol(None, self.volume + random.randint(-10, 10))
+
+    def _event_playlist(self):
+        """Insert or delete one queue song."""
+        pos = random.randint(0, len(self.queue) - 1)
+        if random.random() < 0.5 or len(self.queue) < self.SONGS / 2:
+            self.queue.insert(pos, (self._queued(
+                random.choice(self.library)), 0))
+            if pos <= self.pos and self.state != 'stop':
+                self.pos += 1
+        else:
+            del self.queue[pos]
+            if pos < self.pos:
+                self.pos -= 1
+            elif pos == self.pos:
+                self._set_state(self.state, min(pos, len(self.queue) - 1))
+        self.version += 1
+        for i in xrange(pos, len(self.queue)):
+            self.queue[i] = (self.queue[i][0], self.version)
+        self._emit('playlist')
+
+    def _event_database(self):
+        """Add song to library."""
+        self.library.append(self._song(len(self.library)))
+        self._emit('database', 'update')
+
+    def _drop_clients(self):
+        """Close all client connections, lock is held."""
+        for client in self._clients:
+            client['closed'] = True
+            try:
+                client['sock'].shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+        self._lock.notify_all()
+
+    def _event_drop(self):
+        """Close connections like connection_timeout."""
+        self._drop_clients()
+
+    def _event_restart(self):
+        """Stop listening for RESTART_SEC and close connections."""
+        if self._listener is not None:
+            self._listener.close()
+            self._listener = None
+        self._drop_clients()
+
+
+def press_buttons(pins, control_address):
+    """Press buttons, turn encoder and send control requests forever.
+
+    time.sleep is virtual in child process.
+    """
+    import control
+    while not all(pin in pins for pin in BUTTON_PINS):
+        time.sleep(1)
+    client = None
+    while True:
+        time.sleep(random.expovariate(1.0 / 60))
+        kind = random.random()
+        if kind < 0.1 and all(pin in pins for pin in ENCODER_PINS):
+            a, b = [pins[i] for i in ENCODER_PINS]
+            sequence = [(0, 1), (1, 1), (1, 0), (0, 0)]
+            if random.random() < 0.5:
+                sequence = [(1, 0), (1, 1), (0, 1), (0, 0)]
+            for _ in xrange(random.randint(1, 5)):
+                for value_a, value_b in sequence:
+                    a.set(value_a)
+                    b.set(value_b)
+                    time.sleep(0.005)
+        elif kind < 0.2 and control_address:
+            if client is None:
+                client = control.Client(control_address, timeout=60)
+            try:
+                client.request(*random.choice(
+                    [['play'], ['pause'], ['next'], ['prev'], ['seek', 10],
+                     ['next_album'], ['nothing']]))
+            except control.ControlError:
+                pass
+        else:
+            pin = pins[random.choice(BUTTON_PINS)]
+            # bounce, then hold for click, long press or seek
+            for _ in xrange(random.randint(0, 3)):
+                pin.set(True)
+                time.sleep(0.002)
+                pin.set(False)
+                time.sleep(0.002)
+            pin.set(True)
+            time.sleep(random.choice([0.08, 0.15, 0.9, 2.5, 9.0]))
+            pin.set(False)
+
+
+def snapshot(vclock):
+    """Return resource usage of this process."""
+    gc.collect()
+    objects = {}
+    for obj in gc.get_objects():
+        name = type(obj).__name__
+        objects[name] = objects.get(name, 0) + 1
+    rss = 0
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                rss = int(line.split()[1])
+    pid = os.getpid()
+    children = zombies = 0
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            with open('/proc/%s/stat' % name) as f:
+                stat = f.read()
+        except IOError:
+            continue
+        fields = stat.rpartition(')')[2].split()
+        if int(fields[1]) == pid:
+            children += 1
+            zombies += fields[0] == 'Z'
+    return {'time': vclock.elapsed(), 'rss': rss,
+            'fds': len(os.listdir('/proc/self/fd')) - 1,
+            'threads': threading.active_count(), 'children': children,
+            'zombies': zombies, 'objects': objects}
+
+
+def run_child(args, service_args):
+    """Run service with fakes and virtual clock, sample resource usage."""
+    import ringlog
+    import romaji
+    vclock = Clock(args.speed)
+    accelerate(vclock)
+    smbus = imp.new_module('smbus')
+    smbus.SMBus = FakeSMBus
+    sys.modules['smbus'] = smbus
+    setup = ringlog.setup
+    ringlog.setup = lambda filename, *a, **kw: setup(
+        os.path.join(args.tmp, os.path.basename(filename)), *a, **kw)
+    # fake kakasi echoes, romaji store of indexer is read by services
+    romaji.KAKASI = '/bin/cat'
+    romaji.KAKASI_ARGS = []
+    romaji.Store.__init__.im_func.func_defaults = (
+        os.path.join(args.tmp, 'romaji.db'),)
+    path = os.path.join(BIN_DIR, args.child + '.py')
+    module = imp.load_source(args.child.replace('-', '_'), path)
+    if hasattr(module, 'gpio_open'):
+        pins = {}
+        module.gpio_open = lambda port, *a, **kw: pins.setdefault(
+            port, FakePin())
+        control_address = None
+        if '--control' in service_args:
+            control_address = service_args[
+                service_args.index('--control') + 1]
+        thread = threading.Thread(target=press_buttons,
+                                  args=(pins, control_address))
+        thread.setDaemon(True)
+        thread.start()
+
+    def sample():
+        with open(args.stats, 'a') as f:
+            while True:
+                f.write(json.dumps(snapshot(vclock)) + '\n')
+                f.flush()
+                time.sleep(args.sample_sec)
+    thread = threading.Thread(target=sample)
+    thread.setDaemon(True)
+    thread.start()
+    sys.argv = [path] + service_args
+    module.main()
+
+
+def median(values):
+    """Return median of values."""
+    values = sorted(values)
+    return values[len(values) / 2]
+
+
+def evaluate(samples, args):
+    """Return (failures, summary) of samples after warmup."""
+    warm = [i for i in samples
+            if i['time'] >= args.days * 86400 * args.warmup]
+    if len(warm) < SETTLE_SAMPLES * 2:
+        return ['only %i samples after warmup' % len(warm)], {}
+    first, last = warm[:SETTLE_SAMPLES], warm[-SETTLE_SAMPLES:]
+
+    def growth(key):
+        return (median(i[key] for i in last) -
+                median(i[key] for i in first))
+    summary = {
+        'rss': growth('rss'), 'fds': growth('fds'),
+        'threads': growth('threads'),
+        'children': median(i['children'] for i in last),
+        'zombies': median(i['zombies'] for i in last),
+        'rss_last': last[-1]['rss'], 'fds_last': last[-1]['fds']}
+    names = set()
+    for i in first + last:
+        names.update(i['objects'])
+    objects = sorted(((median(i['objects'].get(name, 0) for i in last) -
+                       median(i['objects'].get(name, 0) for i in first),
+                       name) for name in names), reverse=True)
+    summary['objects'] = objects[:3]
+    failures = []
+    if summary['rss'] > args.rss_budget_kb:
+        failures.append('rss grew %i kB' % summary['rss'])
+    if summary['fds'] > args.fd_budget:
+        failures.append('fds grew %i' % summary['fds'])
+    if summary['threads'] > 0:
+        failures.append('threads grew %i' % summary['threads'])
+    if summary['children'] > args.child_budget or summary['zombies']:
+        failures.append('%i children, %i zombies' % (
+            summary['children'], summary['zombies']))
+    failures.extend('%i more %s objects' % (count, name)
+                    for count, name in objects
+                    if count > args.object_budget)
+    return failures, summary
+
+
+def main():
+    """Run services and check budgets."""
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('services', nargs='*', metavar='SERVICE',
+                        help='services to run(default: all)')
+    parser.add_argument('--days', type=float, default=1.0,
+                        help='simulated days(default: %(default)s)')
+    parser.add_argument('--speed', type=float, default=1000.0,
+                        help='virtual sec per real sec(default: %(default)s)')
+    parser.add_argument('--sample-sec', type=float, default=1800.0,
+                        help='virtual sec between samples')
+    parser.add_argument('--warmup', type=float, default=0.25,
+                        help='ignored fraction of run(default: %(default)s)')
+    parser.add_argument('--rss-budget-kb', type=int, default=1024)
+    parser.add_argument('--fd-budget', type=int, default=0)
+    parser.add_argument('--child-budget', type=int, default=1,
+                        help='child processes alive at end')
+    parser.add_argument('--object-budget', type=int, default=200,
+                        help='growth of gc object count of each type')
+    parser.add_argument('--keep', action='store_true',
+                        help='keep work directory')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--stats', help=argparse.SUPPRESS)
+    parser.add_argument('--tmp', help=argparse.SUPPRESS)
+    argv = sys.argv[1:]
+    service_args = []
+    if '--' in argv:
+        service_args = argv[argv.index('--') + 1:]
+        argv = argv[:argv.index('--')]
+    args = parser.parse_args(argv)
+    if args.child:
+        run_child(args, service_args)
+        return
+    services = args.services or sorted(SERVICES)
+    for name in services:
+        if name not in SERVICES:
+            parser.error('unknown service: %s' % name)
+
+    tmp = tempfile.mkdtemp(prefix='soak-')
+    vclock = Clock(args.speed)
+    mpd = FakeMPD(os.path.join(tmp, 'mpd.sock'), vclock)
+    mpd.start()
+    os.mkdir(os.path.join(tmp, 'bin'))
+    mpc = os.path.join(tmp, 'bin', 'mpc')
+    with open(mpc, 'w') as f:
+        f.write(MPC % {'python': sys.executable,
+                       'bin': os.path.abspath(BIN_DIR)})
+    os.chmod(mpc, 0755)
+    env = dict(os.environ, MPD_HOST=mpd.path,
+               PATH=os.path.join(tmp, 'bin') + ':' + os.environ['PATH'],
+               WATCHDOG_USEC='30000000', NOTIFY_SOCKET='@soak-notify')
+    procs = {}
+    with open(os.devnull, 'w') as devnull:
+        for name in services:
+            stats = os.path.join(tmp, name + '.stats')
+            service_args = [i.format(tmp=tmp, pid=os.getpid())
+                            for i in SERVICES[name]]
+            procs[name] = subprocess.Popen(
+                [sys.executable, os.path.abspath(__file__), '--child', name,
+                 '--speed', str(args.speed), '--sample-sec',
+                 str(args.sample_sec), '--stats', stats, '--tmp', tmp,
+                 '--'] + service_args,
+                stdout=devnull, stderr=open(
+                    os.path.join(tmp, name + '.stderr'), 'w'), env=env)
+        duration = args.days * 86400 / args.speed
+        print 'soak %s for %.1f simulated days(%.0f sec) in %s' % (
+            ', '.join(services), args.days, duration, tmp)
+        exited = {}
+        end = time.time() + duration
+        while time.time() < end and len(exited) < len(procs):
+            time.sleep(0.5)
+            for name, proc in procs.items():
+                if name not in exited and proc.poll() is not None:
+                    exited[name] = proc.returncode
+        for proc in procs.values():
+            if proc.poll() is None:
+                proc.send_signal(signal.SIGTERM)
+        deadline = time.time() + 5
+        for proc in procs.values():
+            while proc.poll() is None and time.time() < deadline:
+                time.sleep(0.05)
+            if proc.poll() is None:
+                proc.kill()
+                proc.wait()
+
+    print 'fake mpd: %i commands, %s' % (mpd.commands, ', '.join(
+        '%i %s' % (count, event) for event, count in sorted(
+            mpd.counts.items())))
+    print '%-18s %-6s %14s %10s %9s  %s' % (
+        'service', 'result', 'rss kB', 'fds', 'children', 'top growth')
+    failed = False
+    for name in services:
+        samples = []
+        stats = os.path.join(tmp, name + '.stats')
+        if os.path.exists(stats):
+            with open(stats) as f:
+                samples = [json.loads(line) for line in f]
+        failures, summary = evaluate(samples, args)
+        if name in exited:
+            failures.insert(0, 'exited early with %i' % exited[name])
+        failed = failed or bool(failures)
+        if summary:
+            print '%-18s %-6s %6i(%+5i) %4i(%+3i) %5i/%iZ  %s' % (
+                name, 'FAIL' if failures else 'ok', summary['rss_last'],
+                summary['rss'], summary['fds_last'], summary['fds'],
+                summary['children'], summary['zombies'],
+                ', '.join('%+i %s' % i for i in summary['objects']))
+        else:
+            print '%-18s %-6s' % (name, 'FAIL')
+        for failure in failures:
+            print '    %s' % failure
+    if args.keep or failed:
+        print 'logs and samples are kept in %s' % tmp
+    else:
+        shutil.rmtree(tmp)
+    # skip interpreter teardown under running fake mpd threads
+    sys.stdout.flush()
+    os._exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/python2
+
+"""Compare service start time of raw scripts and built apps.
+
+Each service module is loaded without calling main(), so this measures
+parse/compile and import cost only.
+Run on the target device to get meaningful numbers.
+"""
+
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+
+RAW = ('import sys; sys.path.insert(0, %(dir)r); '
+       'execfile(%(path)r, {"__name__": "startup_time"})')
+APP = 'import sys; sys.path.insert(0, %(path)r); import %(module)s'
+
+
+def measure(python, code, count):
+    """Return median wall time of python -c code or None if failed."""
+    results = []
+    with open(os.devnull, 'w') as devnull:
+        for _ in xrange(count):
+            start = time.time()
+            if subprocess.call([python, '-c', code], stderr=devnull):
+                return None
+            results.append(time.time() - start)
+    return sorted(results)[len(results) / 2]
+
+
+def main():
+    """Show startup time table."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('src', help='script dir')
+    parser.add_argument('build', help='built app dir')
+    parser.add_argument('--count', type=int, default=10,
+                        help='run count for each service')
+    parser.add_argument('--python', default=sys.executable,
+                        help='python interpreter')
+    args = parser.parse_args()
+
+    def ms(sec):
+        return '%8.1f' % (sec * 1000) if sec is not None else '  failed'
+
+    base = measure(args.python, 'pass', args.count)
+    print 'interpreter startup: %s ms' % ms(base).strip()
+    print '%-24s %8s %8s %8s' % ('service', 'raw ms', 'app ms', 'saved')
+    for name in sorted(os.listdir(args.src)):
+        if not name.endswith('.py') or '-' not in name:
+            continue
+        path = os.path.abspath(os.path.join(args.src, name))
+        app = os.path.abspath(os.path.join(args.build, name[:-3] + '.pyz'))
+        raw_time = measure(args.python, RAW % {
+            'dir': os.path.dirname(path), 'path': path}, args.count)
+        app_time = measure(args.python, APP % {
+            'path': app, 'module': name[:-3].replace('-', '_')}, args.count)
+        if raw_time is not None and app_time is not None:
+            saved = '%7.0f%%' % ((raw_time - app_time) * 100 / raw_time)
+        else:
+            saved = '       -'
+        print '%-24s %s %s %s' % (name[:-3], ms(raw_time), ms(app_time),
+                                  saved)
+
+
+if __name__ == '__main__':
+    main()